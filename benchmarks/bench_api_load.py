@@ -0,0 +1,171 @@
+'''
+Load benchmark for the /update-now-playing ingest API.
+
+Starts the threaded Flask server and the asgi server (uvicorn) on local ports, then drives
+each with the same keep-alive load generator and reports requests/sec and latency percentiles.
+
+usage: python benchmarks/bench_api_load.py [--connections 32] [--requests 200] [--clients 4]
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+from npserver import AsyncIngestApp, ingest_payload
+from npstate import PlayerRegistry
+
+
+def make_payload(i, npclient):
+    return {
+        "album": "LOFI & CHILL VOL.2",
+        "artist": ["Millennium Jazz Music", "Aempoppin"],
+        "title": f"Constant {i % 7}",
+        "duration": "2:14",
+        "elapsed": f"0:{i % 60:02d}",
+        "state": "playing",
+        "npclient": npclient,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def start_flask(players, port):
+    # the same route as now_playing.update_now_playing, served like npapi.run(threaded=True)
+    app = Flask(__name__)
+
+    @app.route('/update-now-playing', methods=['POST'])
+    def update_now_playing():
+        message, status = ingest_payload(players, request.get_data())
+        return jsonify(message), status
+
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server.shutdown
+
+
+def start_asgi(players, port, max_concurrency):
+    import uvicorn
+    config = uvicorn.Config(AsyncIngestApp(players, {}), host="127.0.0.1", port=port,
+                            limit_concurrency=max_concurrency, log_level="error")
+    server = uvicorn.Server(config)
+    Thread(target=server.run, daemon=True).start()
+
+    def stop():
+        server.should_exit = True
+    return stop
+
+
+async def read_response(reader):
+    # returns (status, keep_alive)
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed")
+    version, status = status_line.split()[:2]
+    length = 0
+    keep_alive = version == b"HTTP/1.1"
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        name = name.strip().lower()
+        if name == b"content-length":
+            length = int(value)
+        elif name == b"connection":
+            keep_alive = value.strip().lower() == b"keep-alive"
+    await reader.readexactly(length)
+    return int(status), keep_alive
+
+
+async def connection_worker(port, requests, npclient, latencies, statuses):
+    reader = writer = None
+    for i in range(requests):
+        body = json.dumps(make_payload(i, npclient)).encode()
+        message = (b"POST /update-now-playing HTTP/1.1\r\nHost: localhost\r\n"
+                   b"Content-Type: application/json\r\nConnection: keep-alive\r\n"
+                   b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(message)
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            status, keep_alive = 0, False
+        latencies.append(time.perf_counter() - start)
+        statuses[status] = statuses.get(status, 0) + 1
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def generate_load(port, connections, requests, clients):
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(connection_worker(port, requests, f"bench-{c % clients}", latencies, statuses)
+                           for c in range(connections)))
+    return time.perf_counter() - start, latencies, statuses
+
+
+def report(name, elapsed, latencies, statuses):
+    latencies = sorted(latencies)
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"{name:>6}: {len(latencies) / elapsed:8.0f} req/s  "
+          f"p50 {pct(0.50):7.2f} ms  p99 {pct(0.99):7.2f} ms  max {latencies[-1] * 1000:7.2f} ms  "
+          f"status {dict(sorted(statuses.items()))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=32, help="concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=200, help="requests per connection")
+    parser.add_argument("--clients", type=int, default=1, help="distinct npclient names to post as")
+    parser.add_argument("--max-concurrency", type=int, default=256, help="asgi connection limit")
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    logging.getLogger("npserver").setLevel(logging.ERROR)
+
+    for name, start in (("flask", start_flask), ("asgi", start_asgi)):
+        players = PlayerRegistry()
+        port = free_port()
+        if name == "asgi":
+            stop = start(players, port, args.max_concurrency)
+        else:
+            stop = start(players, port)
+        wait_for_port(port)
+        elapsed, latencies, statuses = asyncio.run(generate_load(port, args.connections, args.requests, args.clients))
+        report(name, elapsed, latencies, statuses)
+        stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+'''
+Benchmark of the CPU cost of dimming the album art on every display update.
+
+set_active() dims the art on every tick. Before, each tick converted the PhotoImage back to PIL,
+composited a full screen overlay and built a new PhotoImage. Now the display keeps the undimmed
+art and a few dimmed variants, and only builds one when the mask level changes.
+
+Three scenarios are run: a steady mask, the dusk dimming ramp, and the display switching between
+active and inactive. Tk needs a display, without one the PhotoImage is replaced by a copy of the
+pixels, which is what Tk does with them.
+
+usage: python benchmarks/bench_art_dimming.py [--ticks 600] [--size 1080]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageTk
+
+import npdisplay
+from npdisplay import DimmedArt, NowPlayingDisplay
+
+
+class Label:
+    def config(self, image=None):
+        pass
+
+
+class Screen:
+    # just the parts of NowPlayingDisplay that set_active_art_with_mask() uses
+    def __init__(self, art):
+        self.active_artwork = DimmedArt(art)
+        self.shown_art_mask = None
+        self.art_lbl = Label()
+
+
+def copy_pixels(image):
+    return Image.frombytes(image.mode, image.size, image.tobytes())
+
+
+def legacy_tick(artwork, mask, photo_image, get_image):
+    # the previous set_active_art_with_mask()
+    pil_image = get_image(artwork)
+    overlay = Image.new('RGBA', pil_image.size, (0, 0, 0, mask))
+    dimmed_image = Image.alpha_composite(pil_image, overlay)
+    return photo_image(dimmed_image)
+
+
+def scenarios(ticks, max_mask, inactive_mask, ramp_ticks):
+    # one tick a second, the dusk ramp reaches max_mask after ramp_ticks
+    ramp = [round(max_mask * min(1, i / ramp_ticks)) for i in range(ticks)]
+    return {
+        "steady": [max_mask] * ticks,
+        "dusk ramp": ramp,
+        "active/inactive": [inactive_mask if (i // 30) % 2 else max_mask for i in range(ticks)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=600, help="display updates per scenario")
+    parser.add_argument("--size", type=int, default=1080, help="size of the album art in pixels")
+    args = parser.parse_args()
+
+    try:
+        from tkinter import Tk
+        root = Tk()
+        root.withdraw()
+        photo_image, get_image = ImageTk.PhotoImage, ImageTk.getimage
+        print("using Tk PhotoImages")
+    except Exception:
+        photo_image, get_image = copy_pixels, copy_pixels
+        npdisplay.ImageTk = type("ImageTk", (), {"PhotoImage": staticmethod(copy_pixels)})
+        print("no display for Tk, PhotoImages are emulated with a copy of the pixels")
+
+    art = Image.effect_noise((args.size, args.size), 64).convert("RGBA")
+    for name, masks in scenarios(args.ticks, npdisplay.MAX_DUSK_DIMMING_MASK, npdisplay.INACTIVE_ART_MASK,
+                                      npdisplay.DIMMING_TIME_MINS * 60).items():
+        artwork = photo_image(art)
+        start = time.process_time()
+        for mask in masks:
+            legacy_tick(artwork, mask, photo_image, get_image)
+        legacy = (time.process_time() - start) / len(masks)
+
+        screen = Screen(art)
+        start = time.process_time()
+        for mask in masks:
+            NowPlayingDisplay.set_active_art_with_mask(screen, mask)
+        cached = (time.process_time() - start) / len(masks)
+
+        print(f"{name:>16}: before {legacy * 1000:7.3f} ms/tick  after {cached * 1000:7.3f} ms/tick  "
+              f"({screen.active_artwork.built} variants built for {len(masks)} ticks)")
+
+
+if __name__ == "__main__":
+    main()
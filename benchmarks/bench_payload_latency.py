@@ -0,0 +1,123 @@
+'''
+Benchmark for the payload channel between the API and the display loop.
+
+Measures the latency from a payload being posted until the display loop has applied it
+to its player in the PlayerRegistry, and how often an idle display loop wakes up per second.
+The old sleep-polling loop is emulated for comparison.
+
+usage: python benchmarks/bench_payload_latency.py [--payloads 200] [--idle 5]
+'''
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nppayload import parse_payload
+from npstate import NowPlayingState, PlayerRegistry
+
+FAST_LOOP_TIME = 0.05  # the sleep used by the old polling loop
+LOOP_TIME = 1.0
+
+
+def make_payload(i):
+    return {
+        "album": f"Album {i // 10}",
+        "artist": ["Artist"],
+        "title": f"Title {i}",
+        "duration": "3:30",
+        "elapsed": "0:01",
+        "state": "playing",
+        "npclient": "bench",
+    }
+
+
+class PollingState(NowPlayingState):
+    '''The previous list based channel, kept here only to compare against'''
+    def __init__(self):
+        super().__init__()
+        self.payload_list = []
+
+    def add_api_payload(self, payload):
+        self.payload_list.append(payload)
+
+    def update_state(self, timeout=0):
+        try:
+            payload = self.payload_list.pop(0)
+        except IndexError:
+            payload = None
+        return self._update_state(payload)
+
+
+def polling_loop(state, stop, applied, wakeups):
+    # emulates the old np_mainloop pacing
+    while not stop.is_set():
+        time.sleep(FAST_LOOP_TIME)
+        wakeups.append(time.monotonic())
+        if not state.update_state():
+            time.sleep(LOOP_TIME - FAST_LOOP_TIME)
+            wakeups.append(time.monotonic())
+            continue
+        applied.append((state.get_title(), time.monotonic()))
+
+
+def queue_loop(state, stop, applied, wakeups):
+    # the np_mainloop pacing with the blocking payload channel
+    while not stop.is_set():
+        updated = state.update_state(timeout=LOOP_TIME)
+        wakeups.append(time.monotonic())
+        if updated:
+            applied.append((state.get_active().get_title(), time.monotonic()))
+
+
+def run(name, state, loop, payloads, idle):
+    stop = Event()
+    applied = []
+    wakeups = []
+    thread = Thread(target=loop, args=(state, stop, applied, wakeups), daemon=True)
+    thread.start()
+
+    # idle phase, nothing is posted
+    time.sleep(idle)
+    idle_wakeups = len(wakeups) / idle
+
+    # latency phase, post payloads at random intervals like a client would
+    posted = {}
+    for i in range(payloads):
+        payload = make_payload(i)
+        posted[payload["title"]] = time.monotonic()
+        state.add_api_payload(parse_payload(payload))
+        time.sleep(random.uniform(0.005, 0.05))
+    time.sleep(LOOP_TIME * 2)
+    stop.set()
+    state.add_api_payload(parse_payload(make_payload(payloads)))
+    thread.join()
+
+    latencies = sorted((t - posted[title]) * 1000 for title, t in applied if title in posted)
+    if not latencies:
+        print(f"{name}: no payloads applied")
+        return
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:>8}: applied {len(latencies)}/{payloads} payloads, "
+          f"latency p50 {statistics.median(latencies):.2f} ms, p99 {p99:.2f} ms, max {latencies[-1]:.2f} ms, "
+          f"idle wakeups {idle_wakeups:.2f}/s")
+    if not isinstance(state, PollingState):
+        print(f"{'':>8}  payload queue: {state.get_payload_stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", type=int, default=200, help="number of payloads to post")
+    parser.add_argument("--idle", type=float, default=5.0, help="seconds to measure idle wakeups")
+    args = parser.parse_args()
+
+    run("polling", PollingState(), polling_loop, args.payloads, args.idle)
+    run("queue", PlayerRegistry(), queue_loop, args.payloads, args.idle)
+
+
+if __name__ == "__main__":
+    main()
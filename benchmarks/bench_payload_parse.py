@@ -0,0 +1,85 @@
+'''
+Micro-benchmark of the payload ingest path: decoding, validating and queueing one payload.
+
+Compares the previous dict based checks with parse_payload() using the json module, and
+using orjson when it is installed.
+
+usage: python benchmarks/bench_payload_parse.py [--payloads 100000]
+'''
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import nppayload
+from npserver import ingest_payload
+from npstate import PlayerRegistry
+
+
+def make_bodies(count):
+    bodies = []
+    for i in range(count):
+        bodies.append(json.dumps({
+            "v": 2,
+            "type": "track",
+            "seq": i,
+            "album": "LOFI & CHILL VOL.2",
+            "artist": ["Millennium Jazz Music", "Aempoppin"],
+            "title": f"Constant {i % 7}",
+            "duration": "2:14",
+            "elapsed": f"0:{i % 60:02d}",
+            "state": "playing",
+            "npclient": f"bench-{i % 4}",
+        }).encode())
+    return bodies
+
+
+def get_empty_payload():
+    return {"album": "", "artist": "", "title": "", "duration": "", "elapsed": "", "state": "", "npclient": ""}
+
+
+def legacy_ingest(bodies):
+    # request.json and the all(key in payload ...) check, then a plain list as the queue
+    queued = []
+    for body in bodies:
+        payload = json.loads(body)
+        if payload and all(key in payload for key in get_empty_payload()):
+            queued.append(payload)
+
+
+def new_ingest(bodies):
+    # ingest_payload() without the display loop draining the queue, same work as legacy_ingest
+    players = PlayerRegistry()
+    for body in bodies:
+        ingest_payload(players, body)
+
+
+def run(name, ingest, bodies):
+    start = time.perf_counter()
+    ingest(bodies)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>14}: {len(bodies) / elapsed:10.0f} payloads/s  ({elapsed / len(bodies) * 1e6:.2f} us/payload)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--payloads", type=int, default=100000, help="number of payloads to ingest")
+    args = parser.parse_args()
+    logging.getLogger("npstate").setLevel(logging.ERROR)
+    bodies = make_bodies(args.payloads)
+
+    run("legacy", legacy_ingest, bodies)
+    backend = nppayload.loads
+    nppayload.loads = json.loads
+    run("parse (json)", new_ingest, bodies)
+    nppayload.loads = backend
+    if nppayload.JSON_BACKEND != "json":
+        run(f"parse ({nppayload.JSON_BACKEND})", new_ingest, bodies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+'''
+Benchmark of the render path, from a posted payload to the frame on the screen.
+
+The display is created headless, so it renders into in-memory PIL frames instead of a Tk window,
+and this runs on a machine without a display. np_mainloop() runs on its own thread as it does on the
+Pi, the ui commands and the frames run on the main thread, and the payloads are posted the way the
+API posts them. Album art for the tracks is generated up front, so nothing is downloaded.
+
+Reports the time from posting a payload until its frame was rendered, for track changes to new
+albums (cold), to albums shown before (warm), and for position updates, plus the frames per second
+and the cost of a full frame and of a frame where only the elapsed time and progress bar changed.
+
+usage: python benchmarks/bench_render.py [--albums 8] [--rounds 3] [--positions 20] [--size 1920x1080]
+'''
+import argparse
+import hashlib
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+import now_playing
+from npserver import ingest_payload
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name, seconds):
+    if seconds:
+        print(f"{name:>22}: {len(seconds):4d}  p50 {percentile(seconds, 0.5) * 1000:7.2f} ms  "
+              f"p99 {percentile(seconds, 0.99) * 1000:7.2f} ms  mean {statistics.mean(seconds) * 1000:7.2f} ms")
+
+
+def track_payload(album, track, seconds):
+    return {
+        "album": f"Album {album}",
+        "artist": [f"Artist {album}"],
+        "title": f"Track {track} of album {album}",
+        "duration": "4:05",
+        "elapsed": f"0:{seconds:02d}",
+        "state": "playing",
+        "npclient": "wiim",
+        "art_url": f"http://bench/art/{album}.png",
+    }
+
+
+def position_payload(seq, seconds):
+    return {"v": 2, "type": "position", "seq": seq, "elapsed": seconds, "state": "playing", "npclient": "wiim"}
+
+
+def make_art(code_path, albums, size):
+    # where resolve_track() looks for the art of a wiim art_url that was already downloaded
+    art_path = os.path.join(code_path, "album_images")
+    os.makedirs(art_path, exist_ok=True)
+    for album in range(albums):
+        url = track_payload(album, 0, 0)["art_url"]
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest() + ".png"
+        Image.effect_noise((size, size), 32 + album).convert("RGBA").save(os.path.join(art_path, name))
+
+
+def drive(args, rendered, results):
+    players, metrics = now_playing.players, now_playing.metrics
+    seq = 0
+
+    def post(payload):
+        rendered.clear()
+        start = time.perf_counter()
+        message, status = ingest_payload(players, payload, metrics)
+        if status != 200:
+            raise RuntimeError(f"payload refused: {status} {message}")
+        if not rendered.wait(10):
+            raise RuntimeError("payload was never rendered")
+        return time.perf_counter() - start
+
+    time.sleep(0.5) # let the display loop set up the display
+    for round_number in range(args.rounds):
+        for album in range(args.albums):
+            elapsed = post(track_payload(album, round_number, 1))
+            results["cold" if round_number == 0 else "warm"].append(elapsed)
+            time.sleep(args.settle) # the text fades in over the next frames
+            for second in range(2, args.positions + 2):
+                seq += 1
+                results["position"].append(post(position_payload(seq, second)))
+    now_playing.running = False
+    now_playing.ui.post(now_playing.tk.quit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--albums", type=int, default=8, help="albums to switch between")
+    parser.add_argument("--rounds", type=int, default=3, help="times to go through the albums, the first is cold")
+    parser.add_argument("--positions", type=int, default=20, help="position updates after each track change")
+    parser.add_argument("--settle", type=float, default=0.5, help="seconds to let the fades finish after a track change")
+    parser.add_argument("--size", default="1920x1080", help="screen size")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.size.split("x"))
+
+    logging.disable(logging.WARNING)
+    code_path = tempfile.mkdtemp(prefix="bench_render_")
+    make_art(code_path, args.albums, 1000)
+    now_playing.CODE_PATH = code_path
+    now_playing.USE_APPLE_DOWNLOADER = False
+    now_playing.create_display(headless=True, size=(width, height))
+
+    # every payload is finished on the main thread once its frame is rendered
+    rendered = Event()
+    finish = now_playing.metrics.finish
+
+    def finish_and_signal(trace, kind):
+        finish(trace, kind)
+        rendered.set()
+
+    now_playing.metrics.finish = finish_and_signal
+
+    results = {"cold": [], "warm": [], "position": []}
+    Thread(target=now_playing.np_mainloop, daemon=True).start()
+    driver = Thread(target=drive, args=(args, rendered, results), daemon=True)
+    driver.start()
+    now_playing.ui.start(now_playing.tk)
+    start = time.perf_counter()
+    now_playing.tk.mainloop()
+    wall = time.perf_counter() - start
+    driver.join()
+
+    stats = now_playing.npui.get_render_stats()
+    full_frames = stats["frames"] - stats["partial_frames"]
+    print(f"headless {width}x{height}, {args.albums} albums, {args.rounds} rounds")
+    report("track change (cold)", results["cold"])
+    report("track change (warm)", results["warm"])
+    report("position update", results["position"])
+    print(f"{'position updates/s':>22}: {len(results['position']) / sum(results['position']):7.1f}")
+    print(f"{'frames':>22}: {stats['frames']} in {wall:.1f} s ({stats['frames'] / wall:.1f} fps), "
+          f"{full_frames} full and {stats['partial_frames']} elapsed time only, "
+          f"{stats['render_seconds'] / max(1, stats['frames']) * 1000:.2f} ms each on average")
+    print(f"{'widget updates':>22}: {stats['render_calls']} sent, {stats['render_skipped']} skipped as unchanged")
+
+
+if __name__ == "__main__":
+    main()
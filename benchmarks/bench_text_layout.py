@@ -0,0 +1,83 @@
+'''
+Benchmark of fitting the title, artist and album text to the display.
+
+The trial approach tries every font size from the largest down, measuring each candidate line at
+that size, until the text fits. TextLayout measures each word once at the largest size, scales the
+widths for smaller sizes and keeps the finished layouts, so a track shown again costs nothing.
+Text is measured with Pillow the way the headless display does, a Tk font measurement costs more.
+
+usage: python benchmarks/bench_text_layout.py [--tracks 200] [--repeats 3]
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nplayout import TextLayout
+from npheadless import get_font
+
+FONT = ("Merriweather", 54, "bold")
+WIDTH = 756 # the wraplength of a 1920x1080 screen
+MAX_LINES = 3
+MIN_SIZE = 32
+
+WORDS = ("Symphony Concerto Sonata No. in D Minor, Op. Allegro Adagio sostenuto ma non troppo Presto "
+         "Andante Quartet for Strings Movement Variations on a Theme by Haydn: I. II. III. IV.").split()
+
+
+class TrialLayout:
+    '''Fit by trial: every size from the largest down, measuring the candidate lines at that size'''
+    def __init__(self, measure):
+        self.measure = measure
+        self.measurements = 0
+
+    def fit(self, text, font, width, max_lines, min_size):
+        for size in range(font[1], min_size - 1, -1):
+            sized = (font[0], size) + font[2:]
+            lines = []
+            for paragraph in text.split("\n"):
+                line = ""
+                for word in paragraph.split(" "):
+                    candidate = f"{line} {word}" if line else word
+                    self.measurements += 1
+                    if line and self.measure(sized, candidate) > width:
+                        lines.append(line)
+                        line = word
+                    else:
+                        line = candidate
+                lines.append(line)
+            if len(lines) * size <= max_lines * font[1]:
+                break
+        return size, "\n".join(lines)
+
+
+def make_titles(count):
+    random.seed(7)
+    return [" ".join(random.choice(WORDS) for _ in range(random.randint(2, 24))) for _ in range(count)]
+
+
+def measure(font, text):
+    return get_font(font).getlength(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=200, help="different titles")
+    parser.add_argument("--repeats", type=int, default=3, help="times each title is shown")
+    args = parser.parse_args()
+
+    titles = make_titles(args.tracks) * args.repeats
+    for name, layout in (("trial", TrialLayout(measure)), ("TextLayout", TextLayout(measure))):
+        start = time.perf_counter()
+        for title in titles:
+            layout.fit(title, FONT, WIDTH, MAX_LINES, MIN_SIZE)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {elapsed / len(titles) * 1000:7.3f} ms per title  "
+              f"{layout.measurements / len(titles):8.1f} measurements per title")
+
+
+if __name__ == "__main__":
+    main()
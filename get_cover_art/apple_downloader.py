@@ -22,7 +22,7 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class AppleDownloader(object):
-    def __init__(self, debug: bool, throttle: float, art_size: int, art_quality: int):
+    def __init__(self, debug: bool, throttle: float, art_size: int, art_quality: int, timeout: float = 10, retries: int = 3):
         quality_suffix = "bb" if art_quality == 0 else f"-{art_quality}"
         self.file_suffix = f"{art_size}x{art_size}{quality_suffix}"
         self.debug = debug
@@ -32,19 +32,24 @@ class AppleDownloader(object):
         else:
             print("debug logging disabled for AppleDownloader")
         self.throttle = throttle
+        self.timeout = timeout
+        self.retries = retries
+        self.fetch = None # a function returning the body of a url, to download through a shared connection pool instead
         self.artist_normalizer = ArtistNormalizer()
         self.album_normalizer = AlbumNormalizer()
         self.deromanizer = DeRomanizer()
         
     def _urlopen_safe(self, url: str) -> str:
-        while True:
+        if self.fetch is not None:
+            return self.fetch(url)
+        for attempt in range(self.retries + 1):
             try:
                 q = Request(url)
                 q.add_header("User-Agent", USER_AGENT)
-                response = urlopen(q)
+                response = urlopen(q, timeout=self.timeout)
                 return response.read()
             except HTTPError as e:
-                if e.code in THROTTLED_HTTP_CODES:
+                if e.code in THROTTLED_HTTP_CODES and attempt < self.retries:
                     # we've been throttled, time to sleep
                     domain = urlparse(url).netloc
                     logger.warning(f"Request limit exceeded from {domain}, trying again in {self.throttle} seconds...")
@@ -163,7 +168,8 @@ class AppleDownloader(object):
         info = self._query(artist, album, norm_title)
         return (artist, album, info, len(album) == 0)
 
-    def download(self, meta: Meta, art_path: str) -> bool:
+    def find(self, meta: Meta) -> Tuple[str, dict]:
+        '''The url of the album art and the album data of the best match for meta, or None'''
         (meta_artist, meta_album, info, title_only) = self._get_data(meta)
         logger.debug(f"Meta artist: {meta_artist}, Meta album: {meta_album}, Info: {info}, Title only: {title_only}")
         if info:
@@ -188,17 +194,29 @@ class AppleDownloader(object):
                         logger.debug(f"Exact album match found: {meta_album} - {album}: {album_info}")
                         break # exact match found
                 if art:
-                    logger.debug(f"Downloading album art for {meta_artist} - {meta_album} - {meta.title}")
-                    image_data = self._urlopen_safe(art)
-                    with open(f'{art_path}{album_info["collectionId"]}.jpg', 'wb') as file:
-                        file.write(image_data)
-                    return image_data, album_info
+                    return art, album_info
 
             except Exception as error:
-                logger.error(f"Error encountered when downloading for artist ({meta_artist}) and album ({meta_album})")
-                logger.error(album_info)
+                logger.error(f"Error encountered when searching for artist ({meta_artist}) and album ({meta_album})")
                 logger.error(error)
 
         logger.debug(f"Failed to find matching artist ({meta_artist}) and album ({meta_album})")
+        return None
+
+    def download(self, meta: Meta, art_path: str) -> bool:
+        found = self.find(meta)
+        if found is not None:
+            art, album_info = found
+            try:
+                logger.debug(f"Downloading album art for {meta.artist} - {meta.album} - {meta.title}")
+                image_data = self._urlopen_safe(art)
+                if art_path is not None: # without an art_path the caller stores the returned image_data
+                    with open(f'{art_path}{album_info["collectionId"]}.jpg', 'wb') as file:
+                        file.write(image_data)
+                return image_data, album_info
+            except Exception as error:
+                logger.error(f"Error encountered when downloading for artist ({meta.artist}) and album ({meta.album})")
+                logger.error(album_info)
+                logger.error(error)
         return False
 
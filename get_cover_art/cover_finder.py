@@ -7,6 +7,8 @@ DEFAULTS = {
     "art_quality": "0", # falls back on default quality
     "art_dest_filename": "{artist} - {album_or_title}.png",
     "throttle": 3,
+    "timeout": 10, # seconds to connect and to wait for each read
+    "retries": 3, # times a throttled request is tried again before giving up
 }
 
 # anotherhobby: this was sourced and modified from the repository below for NowPlayingDisplay: 
@@ -23,7 +25,9 @@ class CoverFinder(object):
         self.external_art_mode = None
         self.external_art_filename = None
         throttle = float(DEFAULTS.get('throttle'))
-        self.downloader = AppleDownloader(self.debug, throttle, self.art_size, self.art_quality)
+        timeout = float(DEFAULTS.get('timeout'))
+        retries = int(DEFAULTS.get('retries'))
+        self.downloader = AppleDownloader(self.debug, throttle, self.art_size, self.art_quality, timeout, retries)
         self.force = True
         self.files_to_delete = set([])
 
@@ -34,6 +38,10 @@ class CoverFinder(object):
             print(f"Skipping existing download for {art_path}")
         return True
 
+    def find(self, meta: Meta):
+        '''The url of the album art and the album data found for meta, without downloading the art, or None'''
+        return self.downloader.find(meta)
+
     def slugify(self, value: str, has_extension=True) -> str:
         """
         Normalizes string, removes non-alpha characters
@@ -1,4 +1,3 @@
-import io
 import json
 import logging
 import sys
@@ -7,19 +6,31 @@ import re
 import signal
 import time
 import hashlib
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
 from tkinter import Tk
 
 import requests
 from bs4 import BeautifulSoup
-from flask import Flask, render_template, jsonify, request
-from PIL import Image, ImageTk
+from flask import Flask, Response, render_template, jsonify, request
+from PIL import Image
 from thefuzz import process
 
 from get_cover_art.cover_finder import DEFAULTS, CoverFinder, Meta
-from npstate import NowPlayingState
+from npstate import PlayerRegistry, UPDATE_TRACK
 from npdisplay import NowPlayingDisplay
+from npheadless import HeadlessDisplay, HeadlessRoot
 from npmusicdata import MusicDataStorage
+from npserver import AsyncIngestApp, ingest_payload, metrics_text, profile_text, response_headers, run_asgi, EVENTS_KEEP_ALIVE, METRICS_CONTENT_TYPE
+from npevents import EventBroadcaster
+from npmetrics import LatencyMetrics
+from npratelimit import IngestRateLimiter
+from npqueue import UICommandQueue
+from npartwork import ArtworkResizer, crossfade_frames, decode_image
+from npartstore import ArtworkStore
+from npfetch import ArtworkFetcher
+from npprefetch import TrackPrefetcher
+from npprofile import profiler
 from nputils import *
 
 logging.basicConfig(level=logging.INFO)
@@ -31,19 +42,59 @@ except ImportError:
     logger.error("local config not found, using default")
     from npsettings import *
 
-tk = Tk()
-npui = NowPlayingDisplay(tk, tk.winfo_screenwidth(), tk.winfo_screenheight())
-state = NowPlayingState()
+tk = None # the Tk root, or a HeadlessRoot, made by create_display()
+npui = None
+screen_height = 0
+ui = UICommandQueue() # everything that touches Tk is posted here and run on the main thread
+artwork = ArtworkResizer(ART_WORKERS, ART_CACHE_MB * 1024 * 1024)
+artwork_store = None # the ArtworkStore in album_images, opened by the display loop
+prefetcher = None # the TrackPrefetcher getting the next track ready, started by the display loop
+resolver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="resolve") # finds the art and album data of new tracks, Apple Music can be slow
+resolving = None # Future of the track being resolved
+shown_track = None # (npclient, title, album) of the track on the display, a track resolved after the display moved on isn't shown
+display_lock = Lock() # held while a track is shown, by the display loop or once it is resolved
+players = PlayerRegistry(MAX_PLAYERS, PLAYER_PRIORITY, MAX_QUEUED_CLIENTS)
+fetcher = ArtworkFetcher(ART_FETCH_WORKERS, ART_FETCH_CONNECT_TIMEOUT, ART_FETCH_READ_TIMEOUT, ART_FETCH_RETRIES)
 finder = CoverFinder(debug=DEBUG)
+finder.downloader.fetch = fetcher.get # the Apple searches and art share the pooled connections and timeouts
 npapi = Flask(__name__, template_folder='www')
-tk.config(cursor="none")
+events = EventBroadcaster(MAX_EVENT_SUBSCRIBERS)
+metrics = LatencyMetrics()
+limiter = IngestRateLimiter(API_CLIENT_RATE, API_CLIENT_BURST, API_ADDRESS_RATE, API_ADDRESS_BURST)
 
 CODE_PATH = os.path.dirname(os.path.abspath(__file__))
 missing_art = Image.open(os.path.join(CODE_PATH, 'images/missing_art.png'))
-npui.set_debug(DEBUG)
-state.set_debug(DEBUG)
+MISSING_ART_KEY = "missing_art"
+wanted_art_key = None # the art the display should show next, art resized for an earlier track is dropped
+wanted_art_lock = Lock() # held while wanted_art_key changes, it is rekeyed on the artwork pool
+metrics.add_counters("ui_", ui.get_stats)
+metrics.add_counters("artwork_", artwork.get_stats)
+metrics.add_counters("fetch_", fetcher.get_stats)
+players.set_debug(DEBUG)
+profiler.set_enabled(PROFILE_DISPLAY, PROFILE_SPANS)
 running = True
 monitor = True
+TICK_SLACK = 0.002 # seconds after a second boundary of the position the display loop wakes, so the new second has begun
+
+
+def create_display(headless=False, size=None):
+    '''
+    Create the Tk root and the Now Playing display, called once on the main thread before anything is posted to ui.
+    headless renders into in-memory PIL frames instead of a window, size is the (width, height) of that screen.
+    '''
+    global tk, npui, screen_height
+    if headless:
+        tk = HeadlessRoot(*(size or HEADLESS_SIZE))
+        display = HeadlessDisplay
+    else:
+        tk = Tk()
+        display = NowPlayingDisplay
+    screen_height = tk.winfo_screenheight()
+    npui = display(tk, tk.winfo_screenwidth(), screen_height)
+    npui.set_debug(DEBUG)
+    tk.config(cursor="none")
+    metrics.add_counters("display_", npui.get_render_stats)
+    return npui
 
 
 def display_setup():
@@ -61,21 +112,19 @@ def display_setup():
     logger.debug(f"Display setup complete. Resolution: {tk.winfo_screenwidth()}x{tk.winfo_screenheight()}")
 
 
-def fetch_album():
-    ''' Get album art and data from Apple Music '''
+def fetch_album(snap, resolved):
+    ''' Find the album on Apple Music, returns the url of its art, its title and url. The album id and artist found are put in resolved '''
     DEFAULTS['art_size'] = "1000"
-    artist = state.get_artist_str()
-    album = state.get_album()
-    meta = Meta(artist=artist, album=album, title=state.get_title())
-    art_path = os.path.join(CODE_PATH, f'album_images/')
-    if not os.path.exists(art_path):
-        os.makedirs(art_path)
+    artist = snap.get_artist_str()
+    album = snap.album
+    meta = Meta(artist=artist, album=album, title=snap.title)
 
-    result = finder.download(meta, art_path)
+    # only search, the art is downloaded on the fetcher by resolve_track(), with a preview
+    result = finder.find(meta)
     
-    if result is not None:
+    if result:
         album_art, data = result
-        state.set_album_id(data.get('collectionId', ""))
+        resolved["album_id"] = data.get('collectionId', "")
         album_title = data.get('collectionName', album)
         if "*" in album_title: # apple music uses a * on explicit titles
             if "*" not in album:
@@ -84,7 +133,7 @@ def fetch_album():
         # use the artist name from the Apple Music album data if available
         apple_artist = data.get('artistName', "")
         if apple_artist != "":
-            state.set_artist(apple_artist.split(","))
+            resolved["artist"] = apple_artist.split(",")
         album_url = data.get("collectionViewUrl", "")
         return album_art, album_title, album_url
     else:
@@ -96,9 +145,7 @@ def fetch_serialized_server_data(url):
     Fetches the serialized server data from the given URL
     '''
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = BeautifulSoup(fetcher.get(url), 'html.parser')
         script_tag = soup.find('script', {'type': 'application/json', 'id': 'serialized-server-data'})
         if script_tag:
             serialized_data = script_tag.string
@@ -135,49 +182,61 @@ def apple_album_data(album_url : str) -> dict:
     return {"tracks": track_data, "released": released, "duration": duration}
 
 
-def current_track():
+def current_track(snap):
     ''' Get the current track number out of the list of tracks '''
-    if len(state.get_tracks()) == 0:
+    tracks = snap.tracks
+    if len(tracks) == 0:
         return ""
 
     # use fuzzy to match the current track to the list of tracks
-    track = process.extractOne(state.get_title(), state.get_tracks())
+    track = process.extractOne(snap.title, tracks)
     if track is not None:
         # get the index of the track in the list of tracks
-        index = state.get_tracks().index(track[0]) + 1
-        return f"{index} of {len(state.get_tracks())}"
+        index = tracks.index(track[0]) + 1
+        return f"{index} of {len(tracks)}"
 
     # old method of matching tracks, will be removed in the future if fuzzy matching works well
-    tracks = state.get_tracks() or []
-    if len(tracks) == 0:
-        return ""
+    title = snap.title.lower()
     for index, name in enumerate(tracks, start=1):
-        if name.lower() == state.get_title().lower():
+        if name.lower() == title:
             return f"{index} of {len(tracks)}"
-        if name.lower() in state.get_title().lower():
+        if name.lower() in title:
             return f"{index} of {len(tracks)}"
-        if strip_paren_words(name.lower()) == strip_paren_words(state.get_title().lower()):
+        if strip_paren_words(name.lower()) == strip_paren_words(title):
             return f"{index} of {len(tracks)}"
 
     return f"? of {len(tracks)}"
 
 
-def split_lines(text):
-    # Check if there's a parenthesis with a space before it
-    if " (" in text:
-        text = text.split(" (", 1)  # Only split on the first occurrence
-        return f"{text[0]}\n({text[1]}"
-    if ": " in text:
-        text = text.split(": ", 1)  # Only split on the first occurrence
-        return f"{text[0]}:\n{text[1]}"
-    return text
-
-
 def strip_paren_words(value: str) -> str:
     '''Remove words in parentesis from the string'''
     result = re.sub(r'\([^)]*\)', '', value)
     return result.strip()
 
+@profiler.profiled("publish")
+def publish_track(snap, track):
+    '''Send a track event to the /events subscribers'''
+    events.publish("track", {
+        "title": snap.title,
+        "artist": list(snap.artist or []),
+        "album": snap.album,
+        "track": track,
+        "duration": snap.duration,
+        "state": snap.player_state,
+        "art_url": snap.art_url,
+        "npclient": snap.npclient
+    })
+
+@profiler.profiled("publish")
+def publish_position(snap):
+    '''Send a position event to the /events subscribers, time lets them keep counting on their own'''
+    events.publish("position", {
+        "elapsed": snap.get_epoc_elapsed(),
+        "duration": snap.duration,
+        "state": snap.player_state,
+        "time": time.time()
+    })
+
 def clear_display():
     '''Clear all text fields on the display'''
     logger.debug("clearing display")
@@ -185,189 +244,410 @@ def clear_display():
     npui.set_artist("")
     npui.set_album("")
     npui.set_track("")
-    npui.set_duration_and_elapsed("", "")
+    npui.set_duration_and_elapsed(0, 0)
     npui.set_album_released("")
     npui.set_album_duration("")
-    npui.set_artwork(mk_album_art(missing_art))
-    tk.update()
+    show_artwork(MISSING_ART_KEY, missing_art)
+
+def show_artwork(key, source, trace=None, preview=None):
+    '''
+    Have the artwork pool decode and resize the art, and post it to the display once it is ready.
+    key identifies the art. Returns True if the art was ready straight away, otherwise the trace is
+    finished when the art is shown.
+    preview, if given, is the (key, source) of a small version of the art that is quicker to get. While
+    the art isn't ready the preview is shown as soon as it is, and the art crossfades in over it.
+    '''
+    global wanted_art_key
+    with wanted_art_lock:
+        wanted_art_key = key
+    size = (screen_height, screen_height)
+    future = artwork.submit(key, source, size, trace)
+    ready = future.done()
+    lock = Lock() # orders showing the preview and the art, their futures finish on different threads
+    shown = {"preview": None, "art": False}
+
+    def show_preview(preview_future):
+        with lock:
+            if shown["art"] or key != wanted_art_key or preview_future.exception() is not None:
+                return # the art beat its preview, the display moved on, or the preview couldn't be had
+            shown["preview"] = preview_future.result()
+            ui.post(npui.set_artwork, shown["preview"], preview[0], key="art")
+            if trace is not None:
+                ui.post(finish_render, trace, "track")
+
+    def show(future):
+        global wanted_art_key
+        with lock:
+            shown["art"] = True
+            preview_image = shown["preview"]
+        if key != wanted_art_key:
+            return # the display moved on to other art while this one was resized
+        try:
+            image = future.result()
+        except Exception as e:
+            logger.error(f"failed to load album art {key}: {e}")
+            if preview_image is None and key != MISSING_ART_KEY:
+                show_artwork(MISSING_ART_KEY, missing_art)
+            return # a preview on the display stays there
+        art_key = key
+        digest = artwork_store.get_digest(key) if key != MISSING_ART_KEY else None
+        if digest is not None:
+            # downloaded art is keyed by its url until it is stored, from here on by its hash like art stored before
+            artwork.rekey(key, digest)
+            with wanted_art_lock:
+                if wanted_art_key != key:
+                    return
+                wanted_art_key = art_key = digest
+        if preview_image is not None:
+            ui.post(npui.crossfade_artwork, crossfade_frames(preview_image, image), art_key, key="art")
+            return
+        ui.post(npui.set_artwork, image, art_key, key="art")
+        if trace is not None and not ready:
+            ui.post(finish_render, trace, "track")
+
+    if not ready and preview is not None:
+        artwork.submit(preview[0], preview[1], size).add_done_callback(show_preview)
+    future.add_done_callback(show)
+    return ready
+
+def art_preview_url(art_url):
+    '''The url of a small version of the art, quick to download and show until the full size art arrives, None if there is none'''
+    if "tidal" in art_url:
+        return re.sub(r'\d{3,4}x\d{3,4}', f'{ART_PREVIEW_SIZE}x{ART_PREVIEW_SIZE}', art_url)
+    if "mzstatic" in art_url: #apple music art
+        return re.sub(r'\d{2,4}x\d{2,4}bb', f'{ART_PREVIEW_SIZE}x{ART_PREVIEW_SIZE}bb', art_url)
+    return None
+
+def art_preview(art_url):
+    '''
+    The (key, source) of the small version of the art at art_url for show_artwork(), None if there is none.
+    It is only downloaded when the art isn't ready, and is decoded straight from the download, previews
+    are never put in the artwork store, only the artwork pool keeps them in memory.
+    '''
+    preview_url = art_preview_url(art_url)
+    if preview_url is None or preview_url == art_url:
+        return None
+    return preview_url, lambda: fetcher.get(preview_url)
+
+def stored_art(resolved):
+    '''Once the art that was downloading when the track was resolved is in the artwork store, key it by its hash like art stored before'''
+    digest = artwork_store.get_digest(resolved["art_key"])
+    if digest is not None:
+        resolved["art"] = artwork_store.image_source(digest)
+        resolved["art_key"] = digest
+
+def fetched_art(future, aliases, fallback=None):
+    '''
+    An art source for the artwork pool: the art future is downloading, put in the artwork store once it arrives.
+    If the download fails the art from fallback is used, a function returning an art source, or the missing art is shown.
+    '''
+    def source():
+        try:
+            data = future.result()
+        except Exception:
+            if fallback is None:
+                raise
+            return decode_image(fallback())
+        return artwork_store.get_image(artwork_store.put(data, aliases=aliases))
+    return source
+
+def show_track(title, artist, album, released, track):
+    '''Set the track labels on the display, runs on the Tk main thread'''
+    npui.set_title(title)
+    npui.set_artist(artist)
+    npui.set_album(album)
+    npui.set_album_released(released)
+    npui.set_track(track)
+
+def finish_render(trace, kind):
+    '''Draw the posted changes and record how long the payload took to show, runs on the Tk main thread'''
+    with profiler.span("tk_update"):
+        tk.update_idletasks()
+    metrics.finish(trace, kind)
+
+def unresolved(snap):
+    '''What resolve_track() returns when nothing was found for the track in snap'''
+    return {
+        "key": (snap.title, snap.album),
+        "art": None, # PIL image, file path, encoded image bytes or a function returning one, decoded by the artwork pool. None shows the missing art
+        "art_key": "", # identifies the art, its hash in the artwork store or its url while it downloads, so the same art isn't set on the display twice
+        "released": "",
+        "album_id": "",
+        "artist": None, # the artist found in the album data, None keeps the artist the client sent
+        "tracks": [],
+        "preview": None, # (key, source) of a small version of the art, shown while the art downloads
+    }
+
+def apply_resolved(player, resolved):
+    '''Put the album id, artist and track list found for the player's track on the player'''
+    player.set_album_id(resolved["album_id"])
+    if resolved["artist"] is not None:
+        player.set_artist(resolved["artist"])
+    player.set_tracks(resolved["tracks"])
+
+def show_resolved(player, resolved, trace=None):
+    '''
+    Show the track of player with the album art and data resolved for it, called with the display_lock held.
+    Returns True if the art was ready straight away, otherwise the trace is finished when the art is shown.
+    '''
+    snap = player.snapshot()
+    track = current_track(snap)
+    player.set_track(track.split(" ")[0])
+    ui.post(show_track, snap.title, snap.get_artist_multi_line(), snap.album, resolved["released"], track, key="track")
+    publish_track(snap, track)
+
+    # decoded and resized on the artwork pool, only building the PhotoImage is left for the main thread
+    if resolved["art"] is not None:
+        stored_art(resolved)
+    if resolved["art"] is None:
+        if wanted_art_key == MISSING_ART_KEY:
+            return True
+        return show_artwork(MISSING_ART_KEY, missing_art, trace)
+    if resolved["art_key"] and resolved["art_key"] == wanted_art_key:
+        return True # the art is on the display already
+    return show_artwork(resolved["art_key"], resolved["art"], trace, resolved["preview"])
+
+def resolve_later(player, snap, trace=None):
+    '''
+    Find the album art and data for the track in snap on the resolver thread, so the display loop keeps
+    ticking while Apple Music is searched. They are put on the player, and shown if the track still is.
+    '''
+    global resolving
+    if resolving is not None:
+        resolving.cancel() # a track skipped before its turn is never resolved
+    resolving = resolver.submit(resolve_track, snap, trace)
+
+    def done(future):
+        if future.cancelled():
+            return
+        try:
+            resolved = future.result()
+        except Exception as e:
+            # generic exception handling, print the exception and continue
+            logger.error(e)
+            resolved = unresolved(snap)
+        with display_lock:
+            with player.lock:
+                if (player.get_title(), player.get_album()) != resolved["key"]:
+                    return # the player moved on to another track
+                apply_resolved(player, resolved)
+                player.set_resolved(resolved)
+            if shown_track != (snap.npclient, snap.title, snap.album):
+                return
+            art_ready = show_resolved(player, resolved, trace)
+        if trace is not None and art_ready:
+            ui.post(finish_render, trace, "track")
+
+    resolving.add_done_callback(done)
+
+@profiler.profiled("resolve_track")
+def resolve_track(snap, trace=None, preview=True):
+    '''
+    Find the album art and album data for the track in snap, without changing any player, see apply_resolved().
+    The result is cached on the player, so switching back to it doesn't need to find them again.
+    trace, if given, is marked when the album data is resolved.
+    preview gets a small version of art that has to be downloaded, to show until the art arrives.
+    '''
+    resolved = unresolved(snap)
+
+    #go through each npclient
+    download = None # the Future of the client's art, while it is downloading
+    if snap.npclient == "wiim":
+        #the art is stored by its content, with the art URL as an alias
+        art_url = snap.art_url
+        digest = artwork_store.lookup(art_url)
+        if digest is None:
+            #art saved by older versions is named by the sha of the art URL, move it into the store
+            old_art_path = os.path.join(artwork_store.folder, hashlib.sha256(art_url.encode('utf-8')).hexdigest() + ".png")
+            if os.path.exists(old_art_path):
+                digest = artwork_store.adopt(old_art_path, aliases=(art_url,))
+
+        if digest is None: #album art doesn't exist for the given URL
+            download_url = art_url
+            if "tidal" in art_url: #substitute default resolution 680x680 to 1080x1080, works for tidal
+                pattern = r'\d{3,4}x\d{3,4}'
+                download_url = re.sub(pattern, '1080x1080', art_url)
+            
+            #download the new image in the background, the artwork pool waits for it so the display loop doesn't
+            logger.debug(f"downloading new album art")
+            download = fetcher.fetch(download_url)
+            resolved["art"] = fetched_art(download, (art_url,))
+            resolved["art_key"] = art_url
+            if preview:
+                resolved["preview"] = art_preview(download_url)
+        else:
+            logger.debug(f"already had album art downloaded")
+            resolved["art"] = artwork_store.image_source(digest)
+            resolved["art_key"] = digest
+    else:
+        pass #put other clients here, if desired
+
+    # try to get the album art and data from Apple Music
+    if USE_APPLE_DOWNLOADER:
+        result = fetch_album(snap, resolved)
+
+        if result is not None:
+            apple_art_url, album, album_url = result
+            # use the apple image if the client didn't provide one, or its download fails
+            if resolved["art"] is None:
+                digest = artwork_store.lookup(album_url)
+                if digest is None:
+                    resolved["art"] = fetched_art(fetcher.fetch(apple_art_url), (album_url,))
+                    resolved["art_key"] = album_url
+                    if preview:
+                        resolved["preview"] = art_preview(apple_art_url)
+                else:
+                    resolved["art"] = artwork_store.image_source(digest)
+                    resolved["art_key"] = digest
+                logger.debug(f"set fallback apple image for album: {snap.album}")
+            elif download is not None:
+                resolved["art"] = fetched_art(download, (art_url,), fallback=lambda: fetcher.get(apple_art_url))
+
+            album_data = apple_album_data(album_url)
+            resolved["tracks"] = album_data["tracks"]
+            resolved["released"] = album_data["released"]
+        else:
+            logger.debug("No album art found")
+            # if album art is provided, use it for the missing art, otherwise use the default missing art
+            if resolved["art"] is None and snap.art_url != "":
+                digest = artwork_store.lookup(snap.art_url)
+                if digest is None:
+                    resolved["art"] = fetched_art(fetcher.fetch(snap.art_url), (snap.art_url,))
+                    resolved["art_key"] = snap.art_url
+                    if preview:
+                        resolved["preview"] = art_preview(snap.art_url)
+                else:
+                    resolved["art"] = artwork_store.image_source(digest)
+                    resolved["art_key"] = digest
+
+    if trace is not None:
+        trace.mark("resolved")
+    return resolved
+
+
+def prefetch_track(snap):
+    '''Find the album art and data of the next track and resize its art ahead of time, runs on the prefetch thread'''
+    # the art is ready before the track is shown, it needs no preview
+    resolved = resolve_track(snap, preview=False)
+    if resolved["art"] is not None:
+        # download and decode the art on this thread, so the artwork pool only resizes it
+        image = decode_image(resolved["art"])
+        stored_art(resolved)
+        artwork.submit(resolved["art_key"], image, (screen_height, screen_height))
+    return resolved
+
 
 def np_mainloop():
-    ''' Main loop for the Now Playing display, updates the display with new information every second'''
+    '''
+    Main loop for the Now Playing display, updates the display with new information every second.
+    Runs on its own thread and never touches Tk, the changes are posted to ui for the main thread.
+    '''
     logger.debug("waiting for the display to be ready...")
-    display_setup()
-    clear_display()
+    ui.post(display_setup)
+    ui.post(clear_display)
     old_title = ""
     old_album = ""
-    old_album_art_path = ""
-    album_for_current_art = ""
-    new_art = True #tells the disiplay to refresh the art or not
+    old_npclient = ""
     
     art_path = os.path.join(CODE_PATH, f'album_images/')
-    if not os.path.exists(art_path):
-        os.makedirs(art_path)
-
-    loop_time = 1.0
-    fast_loop_time = FAST_LOOP_TIME
-
-    #ensure that 0 < fast_loop_time <= loop_time
-    if (fast_loop_time > loop_time) or (FAST_LOOP_TIME <= 0):
-        fast_loop_time = loop_time
+    global artwork_store
+    artwork_store = ArtworkStore(art_path, ART_STORE_MB * 1024 * 1024, ART_MEMORY_MB * 1024 * 1024,
+                                 MAX_STORED_ALBUM_IMAGES)
+    metrics.add_counters("artstore_", artwork_store.get_stats)
+    global prefetcher, shown_track
+    prefetcher = TrackPrefetcher(prefetch_track)
+    metrics.add_counters("prefetch_", prefetcher.get_stats)
 
     display_is_active = True
+    snap = players.snapshot()
 
     while running:
         try:
-            #sleep for a minimum of fast_loop_time
-            time.sleep(fast_loop_time)
-
-            #sleep longer if no update has been published
-            if not state.update_state():
-                #if no new data is available, sleep for longer
-                #fast_loop_time is guaranteed to be between 0 and loop_time
-                if display_is_active:
-                    npui.set_duration_and_elapsed(state.get_duration(), state.get_epoc_elapsed())
-                time.sleep(loop_time - fast_loop_time)
-                continue
+            #block until a payload is published, waking just after the elapsed time reaches its next second
+            #while paused, at the end of the track or behind the screensaver there is nothing to tick, so wait much longer
+            tick = snap.position.get_next_tick() if display_is_active else None
+            updated = players.update_state(timeout=tick + TICK_SLACK if tick is not None else IDLE_LOOP_TIME)
+            # the time spent on the display after waking up, waiting for a payload isn't part of it
+            with profiler.span("display_loop"):
+                #read the whole state of the shown player once per iteration, the API threads may change it at any time
+                snap = players.snapshot()
+                trace = players.get_trace()
+                art_ready = True
+                if not updated:
+                    if display_is_active:
+                        ui.post(npui.set_duration_and_elapsed, snap.position.duration, snap.position.get_elapsed(), key="position")
+                    continue
             
-            #determine if the display should be active or inactive
-            if state.get_player_state() == "playing" and not display_is_active:
-                logger.debug("SETTING ACTIVE")
-                npui.set_active()
-                display_is_active = True
-            elif state.get_player_state() != "playing" and display_is_active:
-                logger.debug("SETTING INACTIVE")
-                npui.set_inactive() # set the display to inactive (dim)
-                keep_recent_files(art_path, MAX_STORED_ALBUM_IMAGES)
-                display_is_active = False
-
-            #get the title of the currently playing track
-            title = state.get_title()
-            album = state.get_album()
-            if (title is not None) and ((title != old_title) or (album != old_album)): # the song title or album has changed, update the display
-                old_title = title
-                old_album = album
-                logger.debug(f"Title or Album has changed: {title} {album}")
-
-                if title == "" or (state.get_player_state() != "playing" and display_is_active):
-                    npui.set_inactive() # set the display to inactive (dim)
+                #determine if the display should be active or inactive
+                if snap.player_state == "playing" and not display_is_active:
+                    logger.debug("SETTING ACTIVE")
+                    ui.post(npui.set_active, key="activity")
+                    display_is_active = True
+                elif snap.player_state != "playing" and display_is_active:
+                    logger.debug("SETTING INACTIVE")
+                    ui.post(npui.set_inactive, key="activity") # set the display to inactive (dim)
                     display_is_active = False
-                    continue
-                try:
-                    #go through each npclient
-                    if state.get_npclient() == "wiim":
-                        #get the art url, find the sha, set the filename to be that
-                        art_url = state.get_art_url()
-                        art_url_hash = hashlib.sha256(art_url.encode('utf-8')).hexdigest()
-                        album_art_path = str(art_path) + art_url_hash + ".png" #the filename will be the sha of the art URL
-
-                        album_image_to_show = None
-
-                        if not os.path.exists(album_art_path): #album art doesn't exist for the given URL
-                            if "tidal" in art_url: #substitute default resolution 680x680 to 1080x1080, works for tidal
-                                pattern = r'\d{3,4}x\d{3,4}'
-                                art_url = re.sub(pattern, '1080x1080', art_url)
-                            
-                            #get the new image
-                            with requests.get(art_url, stream=True) as response:
-                                if response.status_code == 200:
-                                    with Image.open(response.raw) as image:
-                                        logger.debug(f"downloading new album art")
-                                        # Convert image to RGBA format to ensure 32-bit depth
-                                        image = image.convert("RGBA")
-                                        album_image_to_show = image
-                                        if "tidal" in art_url: #save for tidal (can test for other URLs that are worth saving)
-                                            image.save(album_art_path)
-                                    new_art = True
-                        else:
-                            logger.debug(f"already had album art downloaded")
-                            if old_album_art_path != album_art_path:
-                                with Image.open(album_art_path) as image:
-                                    album_image_to_show = image.copy()
-                                    old_album_art_path = album_art_path
-                                new_art = True
-                            else:
-                                new_art = False
-                    else:
-                        pass #put other clients here, if desired
-                        # try to get the album art and data from Apple Music
-
-                    if USE_APPLE_DOWNLOADER:
-                        result = fetch_album()
-
-                        if result is not None:
-                            art, album, album_url = result
-                            # set the album art to the new image
-                            if not os.path.exists(album_art_path): 
-                                npui.set_artwork(mk_album_art(io.BytesIO(art)))
-                                logger.debug(f"set fallback apple image for album: {state.get_album()}")
-                
-                            #album_for_current_art = album
-                            album_data = apple_album_data(album_url)
-                            state.set_tracks(album_data["tracks"])
-                            npui.set_album_released(album_data["released"])
-                            #npui.set_album_duration(album_data["duration"])                            
-                        else:
-                            logger.debug("No album art found")
-                            # if album art is provided, use it for the missing art, otherwise use the default missing art
-                            if album_for_current_art != "":
-                                image_data = finder.downloader._urlopen_safe(state.get_art_url())
-                                npui.set_artwork(mk_album_art(io.BytesIO(image_data)))
-                            else:
-                                logger.debug("No album art found, using default")
-                                npui.set_artwork(mk_album_art(missing_art))
-                            album_for_current_art = state.get_album()
-                            state.set_tracks([])
-                            npui.set_album_released("")
-                            npui.set_album_duration("") 
-
-                except Exception as e:
-                    # generic exception handling, print the exception and continue
-                    logger.error(e)
-                    pass
 
-                # set song title on the display
-                npui.set_title(split_lines(title))
-                
-                # set the artist on the display
-                npui.set_artist(state.get_artist_multi_line())
-
-                # set the album on the display
-                npui.set_album(split_lines(state.get_album()))
-                
-                track = current_track()
-                state.set_track(track.split(" ")[0])
-                npui.set_track(track)
-                
-                if new_art:
-                    if album_image_to_show:
-                        npui.set_artwork(mk_album_art(album_image_to_show))
+                #get the title of the currently playing track
+                title = snap.title
+                album = snap.album
+                # position heartbeats never change the title or album, skip straight to the elapsed time
+                # switching to another player always refreshes the display
+                if updated == UPDATE_TRACK and (title is not None) and ((title != old_title) or (album != old_album) or (snap.npclient != old_npclient)): # the song title or album has changed, update the display
+                    old_title = title
+                    old_album = album
+                    old_npclient = snap.npclient
+                    logger.debug(f"Title or Album has changed: {title} {album}")
+
+                    with display_lock:
+                        shown_track = (snap.npclient, title, album)
+                    if title == "" or (snap.player_state != "playing" and display_is_active):
+                        ui.post(npui.set_inactive, key="activity") # set the display to inactive (dim)
+                        display_is_active = False
+                        continue
+
+                    player = players.get_player(snap.npclient)
+                    resolved = player.get_resolved()
+                    if resolved is None or resolved["key"] != (title, album):
+                        resolved = prefetcher.take((snap.npclient, title, album))
+                        if resolved is not None:
+                            logger.debug(f"using prefetched album art and data for {snap.npclient}")
+                            if trace is not None:
+                                trace.mark("resolved")
+                            apply_resolved(player, resolved)
+                            player.set_resolved(resolved)
                     else:
-                        npui.set_artwork(mk_album_art(missing_art))
-
-                del album_image_to_show
+                        logger.debug(f"using cached album art and data for {snap.npclient}")
 
-            if display_is_active: #put any tasks here that should run every time the display updates
-                #this will also run when the regular "duration sync" occurs, around 10s by default
-                #duration and elapsed are updated, along with the active text colour and art mask (for dimming)
-                npui.set_active()
-                npui.set_duration_and_elapsed(state.get_duration(), state.get_epoc_elapsed())
+                    if resolved is not None:
+                        with display_lock:
+                            art_ready = show_resolved(player, resolved, trace)
+                    else:
+                        # show what the client sent straight away, the art, release date and track number follow once resolved
+                        ui.post(show_track, title, snap.get_artist_multi_line(), album, "", "", key="track")
+                        publish_track(snap, "")
+                        resolve_later(player, snap, trace)
+                        art_ready = False
+
+                if updated == UPDATE_TRACK and PREFETCH_NEXT_TRACK and snap.next_track is not None:
+                    # get the next track ready while this one plays, so skipping to it doesn't wait for anything
+                    next_track = snap.next_track
+                    prefetcher.submit((snap.npclient, next_track.title, next_track.album), snap.get_next())
+
+                if display_is_active: #put any tasks here that should run every time the display updates
+                    #this will also run when the regular "duration sync" occurs, around 10s by default
+                    #duration and elapsed are updated, along with the active text colour and art mask (for dimming)
+                    ui.post(npui.set_active, key="activity")
+                    ui.post(npui.set_duration_and_elapsed, snap.position.duration, snap.position.get_elapsed(), key="position")
+                publish_position(snap)
             
-            tk.update_idletasks() 
-            tk.update()
+                if trace is not None and (updated != UPDATE_TRACK or art_ready):
+                    # when the art is still being resized, the trace is finished once it is shown
+                    ui.post(finish_render, trace, "track" if updated == UPDATE_TRACK else "position")
 
         except Exception as e:
             logger.error(e)
 
-def mk_album_art(image):
-    # Resize the original image to the screen height
-    original_art = None
-
-    # Create a copy of the resized image
-    original_art = ImageTk.PhotoImage(image.resize((tk.winfo_screenheight(), tk.winfo_screenheight())))
-
-    return original_art
-
-
 def signal_handler(sig, frame):
     # best effort to exit the program
     global running
@@ -386,28 +666,40 @@ def update_now_playing():
         return jsonify({"message": "display is powered off"}), 200
     else:
         logger.debug(f"display is powered on, processing request")
-    try:
-        payload = request.json
-        logger.debug(f"api received: {payload}")
-    except Exception as e:
-        logger.error(e)
-        logger.error(request.data)
-        return jsonify({"message": "Invalid JSON payload"}), 400
-    # require all keys in the payload to be present
-    if payload and all(key in payload for key in state.get_empty_payload()):
-        # only allow updates from one client at a time
-        if payload["npclient"] != state.get_npclient():
-            logger.debug(f"client mismatch: {payload['npclient']} != {state.get_npclient()}")
-            if state.get_npclient() != None: # no client yet?
-                logger.debug(f"last update: {state.get_last_update_time()}")
-                if time.time() - state.get_last_update_time() < 60: # 60s of inactivity required to switch clients
-                    logger.debug(f"client mismatch, wait 60s")
-                    return jsonify({"message": "Client mismatch, wait 60s"}), 400
-        state.add_api_payload(payload)
-        return jsonify({"message": "Payload received successfully"}), 200
-    else:
-        logger.debug(f"invalid payload: {payload}")
-        return jsonify({"message": "Invalid payload"}), 400
+    body = request.get_data()
+    logger.debug(f"api received: {body}")
+    message, status = ingest_payload(players, body, metrics, limiter, request.remote_addr)
+    return jsonify(message), status, response_headers(message, status)
+
+@npapi.route('/metrics')
+def latency_metrics():
+    '''Per stage latency histograms of payloads on their way to the display, in the Prometheus text format'''
+    return Response(metrics_text(metrics, players, limiter), content_type=METRICS_CONTENT_TYPE)
+
+@npapi.route('/profile')
+def display_profile():
+    '''What the display spent its time on, a summary table or with ?format=folded stacks for flame graph tools'''
+    text = profile_text(profiler, request.args.get("format"))
+    if text is None:
+        return jsonify({"message": "Profiling is disabled"}), 404
+    return Response(text, content_type="text/plain; charset=utf-8")
+
+@npapi.route('/events')
+def now_playing_events():
+    '''Server-Sent Events stream of track and position changes, for secondary displays'''
+    subscription = events.subscribe()
+    if subscription is None:
+        return jsonify({"message": "Too many subscribers"}), 503
+
+    def stream():
+        try:
+            while running:
+                message = subscription.get(timeout=EVENTS_KEEP_ALIVE)
+                yield message or b": keep-alive\n\n"
+        finally:
+            events.unsubscribe(subscription)
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @npapi.route('/')
 def index():
@@ -423,11 +715,22 @@ def albums():
     data = MusicDataStorage().retrieve_albums()
     return render_template('albums.html', data=data)
 
+def asgi_page(view):
+    '''Wrap a Flask view so the asgi server can render it outside of a Flask request'''
+    def render():
+        with npapi.test_request_context():
+            return view()
+    return render
+
 def start_api():
-    '''Start the Flask API to accept requests to update the now playing information.'''
-    flask_log = logging.getLogger('werkzeug')
-    flask_log.setLevel(logging.ERROR)
-    npapi.run(host='0.0.0.0', port=5432, threaded=True)
+    '''Start the API to accept requests to update the now playing information.'''
+    if API_SERVER == "asgi":
+        pages = {"/": asgi_page(index), "/tracks": asgi_page(tracks), "/albums": asgi_page(albums)}
+        run_asgi(AsyncIngestApp(players, pages, events, metrics=metrics, limiter=limiter, profiler=profiler), '0.0.0.0', npapi_port, API_MAX_CONCURRENCY, API_KEEP_ALIVE)
+    else:
+        flask_log = logging.getLogger('werkzeug')
+        flask_log.setLevel(logging.ERROR)
+        npapi.run(host='0.0.0.0', port=npapi_port, threaded=True)
 
 
 if __name__ == "__main__":
@@ -435,6 +738,8 @@ if __name__ == "__main__":
     if DEBUG:
         logger.setLevel(logging.DEBUG)
 
+    create_display(HEADLESS)
+
     logger.info("Starting API...")
     api_thread = Thread(target=start_api)
     api_thread.daemon = True  # Daemon threads automatically close when the main program exits
@@ -446,6 +751,7 @@ if __name__ == "__main__":
     display_thread.start()
 
     logger.info("Starting main display loop...")
+    ui.start(tk)
     try:
         tk.mainloop()
     finally:
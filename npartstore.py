@@ -0,0 +1,308 @@
+import functools
+import hashlib
+import io
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif"} # the formats the screensaver reads too
+ALIASES_FILE = "aliases.tsv"
+ACCESS_LOG = "access.log" # the order the art was used in, a line per use, later lines are more recent
+
+
+class ArtworkStore:
+    """
+    All album art in one place, in two tiers.
+
+    The disk tier keeps the encoded art in folder, named by the sha256 of its bytes, so art shared by
+    several urls or albums is only stored once. Aliases (art urls, Apple collection ids, MusicBrainz
+    release ids) map to those hashes, and are appended to aliases.tsv so they last across restarts.
+    The memory tier is an LRU of the decoded images in front of it.
+    Both tiers have a byte budget, the least recently used art goes first.
+
+    The order the art on disk was used in is appended to access.log on every hit and write, and
+    replayed when the store opens, so the folder is never scanned (atime is useless on a noatime
+    SD card). Evicting takes the oldest entries off the index, the files are removed in the background.
+    """
+    def __init__(self, folder, disk_bytes=512 * 1024 * 1024, memory_bytes=64 * 1024 * 1024, max_files=10000):
+        self.folder = folder
+        self.disk_bytes = disk_bytes
+        self.memory_bytes = memory_bytes
+        self.max_files = max_files
+        self.lock = Lock()
+        self.files = OrderedDict() # hash -> (file name, size in bytes), least recently used first
+        self.files_bytes = 0
+        self.aliases = {} # alias -> hash
+        self.digest_aliases = {} # hash -> aliases of it, to drop them when the art is evicted
+        self.access_log = None
+        self.log_lines = 0
+        self.remover = ThreadPoolExecutor(max_workers=1, thread_name_prefix="artstore")
+        self.images = OrderedDict() # hash -> decoded RGBA image, least recently used first
+        self.images_bytes = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.memory_hits = 0
+        self.memory_misses = 0
+        self.evicted = 0
+        os.makedirs(folder, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # the art on disk in the order it was used, and the aliases of the art that is still there
+        try:
+            with open(os.path.join(self.folder, ACCESS_LOG), encoding="utf-8") as file:
+                for line in file:
+                    self._replay(line.rstrip("\n").split("\t"))
+                    self.log_lines += 1
+        except FileNotFoundError:
+            self._migrate()
+        stale = 0
+        try:
+            with open(os.path.join(self.folder, ALIASES_FILE), encoding="utf-8") as file:
+                for line in file:
+                    alias, _, digest = line.rstrip("\n").rpartition("\t")
+                    if digest in self.files:
+                        self._add_alias(alias, digest)
+                    else:
+                        stale += 1
+        except FileNotFoundError:
+            pass
+        if stale:
+            self._write_aliases()
+        with self.lock:
+            self._compact_log()
+            self._evict_files()
+
+    def _replay(self, fields):
+        # a use or write of the art is "hash, file name, size", an eviction is "hash, -"
+        # anything else is a line torn by a power cut, it is skipped and the compaction on load drops it
+        if len(fields) == 3 and fields[0] and fields[1]:
+            digest, filename, size = fields
+            try:
+                size = int(size)
+            except ValueError:
+                return
+            entry = self.files.get(digest)
+            self.files_bytes += size - (entry[1] if entry is not None else 0)
+            self.files[digest] = (filename, size)
+            self.files.move_to_end(digest)
+        elif len(fields) == 2 and fields[1] == "-":
+            self._forget_file(fields[0])
+
+    def _migrate(self):
+        # no access log yet: index the art that is already there, oldest first, this is the only scan of the folder
+        found = []
+        for entry in os.scandir(self.folder):
+            name, extension = os.path.splitext(entry.name)
+            if extension in IMAGE_EXTENSIONS.values() and entry.is_file():
+                stat = entry.stat()
+                found.append((stat.st_mtime, name, entry.name, stat.st_size))
+        for _, digest, filename, size in sorted(found):
+            self.files[digest] = (filename, size)
+            self.files_bytes += size
+
+    def _log(self, line):
+        # called with the lock held
+        self.access_log.write(line)
+        self.log_lines += 1
+        if self.log_lines > 2 * len(self.files) + 1000:
+            self._compact_log()
+
+    def _log_use(self, digest):
+        filename, size = self.files[digest]
+        self._log(f"{digest}\t{filename}\t{size}\n")
+
+    def _compact_log(self):
+        # rewrite the log with a line for each file, in the order they were used
+        if self.access_log is not None:
+            self.access_log.close()
+        path = os.path.join(self.folder, ACCESS_LOG)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.writelines(f"{digest}\t{filename}\t{size}\n" for digest, (filename, size) in self.files.items())
+        os.replace(path + ".tmp", path)
+        self.log_lines = len(self.files)
+        self.access_log = open(path, "a", encoding="utf-8", buffering=1)
+
+    def _add_alias(self, alias, digest):
+        old = self.aliases.get(alias)
+        if old is not None and old != digest:
+            self.digest_aliases[old].discard(alias)
+        self.aliases[alias] = digest
+        self.digest_aliases.setdefault(digest, set()).add(alias)
+
+    def _write_aliases(self):
+        path = os.path.join(self.folder, ALIASES_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            file.writelines(f"{alias}\t{digest}\n" for alias, digest in self.aliases.items())
+        os.replace(path + ".tmp", path)
+
+    def _append_aliases(self, aliases, digest):
+        # called with the lock held
+        new = [alias for alias in aliases if alias and self.aliases.get(alias) != digest]
+        if not new:
+            return
+        for alias in new:
+            self._add_alias(alias, digest)
+        with open(os.path.join(self.folder, ALIASES_FILE), "a", encoding="utf-8") as file:
+            file.writelines(f"{alias}\t{digest}\n" for alias in new)
+
+    def lookup(self, alias):
+        '''The hash of the art stored for alias, or None'''
+        with self.lock:
+            digest = self.aliases.get(alias)
+            if digest is not None and digest in self.files:
+                self.files.move_to_end(digest)
+                self._log_use(digest)
+                self.disk_hits += 1
+                return digest
+            self.disk_misses += 1
+            return None
+
+    def get_digest(self, alias):
+        '''The hash of the art stored for alias, or None, like lookup() but it isn't counted as a use of the art'''
+        with self.lock:
+            digest = self.aliases.get(alias)
+            return digest if digest in self.files else None
+
+    def put(self, data, aliases=()):
+        '''Store the encoded art in data under its hash, and add the aliases for it. Returns the hash'''
+        with Image.open(io.BytesIO(data)) as image:
+            extension = IMAGE_EXTENSIONS.get(image.format, ".png")
+        if extension == ".png" and not data.startswith(b"\x89PNG"):
+            # a format the screensaver can't read, store it as a png
+            buffer = io.BytesIO()
+            with Image.open(io.BytesIO(data)) as image:
+                image.save(buffer, "PNG")
+            data = buffer.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if digest not in self.files:
+                filename = digest + extension
+                path = os.path.join(self.folder, filename)
+                with open(path + ".tmp", "wb") as file:
+                    file.write(data)
+                os.replace(path + ".tmp", path)
+                self.files[digest] = (filename, len(data))
+                self.files_bytes += len(data)
+            self.files.move_to_end(digest)
+            self._log_use(digest)
+            self._append_aliases(aliases, digest)
+            self._evict_files(keep=digest)
+        return digest
+
+    def adopt(self, path, aliases=()):
+        '''Move art saved outside the store, like the url named files of older versions, into it'''
+        with open(path, "rb") as file:
+            data = file.read()
+        digest = self.put(data, aliases)
+        if os.path.abspath(path) != os.path.abspath(self.get_path(digest) or ""):
+            old_digest = os.path.splitext(os.path.basename(path))[0]
+            with self.lock:
+                if old_digest in self.files:
+                    self._forget_file(old_digest)
+                    self._log(f"{old_digest}\t-\n")
+            os.remove(path)
+        return digest
+
+    def get_path(self, digest):
+        with self.lock:
+            entry = self.files.get(digest)
+        return os.path.join(self.folder, entry[0]) if entry is not None else None
+
+    def get_image(self, digest):
+        '''The decoded RGBA art for the hash, from memory if it is there. Raises KeyError if it isn't stored'''
+        with self.lock:
+            image = self.images.get(digest)
+            if image is not None:
+                self.images.move_to_end(digest)
+                self.memory_hits += 1
+                return image
+            self.memory_misses += 1
+            entry = self.files.get(digest)
+            if entry is None:
+                raise KeyError(digest)
+            self.files.move_to_end(digest)
+            self._log_use(digest)
+        try:
+            with Image.open(os.path.join(self.folder, entry[0])) as image:
+                image.load()
+                image = image.convert("RGBA")
+        except FileNotFoundError:
+            # removed behind the store's back
+            with self.lock:
+                if digest in self.files:
+                    self._forget_file(digest)
+                    self._log(f"{digest}\t-\n")
+            raise KeyError(digest)
+        with self.lock:
+            self._remember_image(digest, image)
+        return image
+
+    def image_source(self, digest):
+        '''A function returning the decoded art, for the artwork pool to call on its own threads'''
+        return functools.partial(self.get_image, digest)
+
+    def _remember_image(self, digest, image):
+        # called with the lock held
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.memory_bytes or digest in self.images:
+            return
+        self.images[digest] = image
+        self.images_bytes += nbytes
+        while self.images_bytes > self.memory_bytes:
+            _, evicted = self.images.popitem(last=False)
+            self.images_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def _forget_file(self, digest):
+        # called with the lock held, drops the art and its aliases from the index
+        entry = self.files.pop(digest, None)
+        if entry is not None:
+            self.files_bytes -= entry[1]
+        for alias in self.digest_aliases.pop(digest, ()):
+            del self.aliases[alias]
+
+    def _evict_files(self, keep=None):
+        # called with the lock held, takes the least recently used art off the index until the disk tier
+        # fits its budgets, only touching the art it evicts. Stale lines in aliases.tsv are dropped on the next load
+        filenames = []
+        while (self.files_bytes > self.disk_bytes or len(self.files) > self.max_files) and len(self.files) > 1:
+            digest, (filename, _) = next(iter(self.files.items()))
+            if digest == keep:
+                break
+            self._forget_file(digest)
+            self._log(f"{digest}\t-\n")
+            filenames.append((digest, filename))
+            self.evicted += 1
+        if filenames:
+            self.remover.submit(self._remove_files, filenames)
+
+    def _remove_files(self, filenames):
+        for digest, filename in filenames:
+            with self.lock:
+                if digest in self.files:
+                    continue # stored again since it was evicted
+                try:
+                    os.remove(os.path.join(self.folder, filename))
+                except FileNotFoundError:
+                    pass
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "disk_hits": self.disk_hits,
+                "disk_misses": self.disk_misses,
+                "disk_files": len(self.files),
+                "disk_bytes": self.files_bytes,
+                "disk_evicted": self.evicted,
+                "memory_hits": self.memory_hits,
+                "memory_misses": self.memory_misses,
+                "memory_images": len(self.images),
+                "memory_bytes": self.images_bytes,
+            }
@@ -0,0 +1,133 @@
+import io
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+
+from PIL import Image
+
+from npprofile import profiler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CROSSFADE_STEPS = 6 # frames of the crossfade from the preview to the full size art, each is a full screen image
+
+
+def decode_image(source):
+    '''Open album art given as a PIL image, a file path, the encoded bytes or a function returning one of them, as RGBA'''
+    if callable(source):
+        source = source()
+    if isinstance(source, Image.Image):
+        image = source
+    elif isinstance(source, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(source))
+    else:
+        with Image.open(source) as image:
+            image.load()
+            return image.convert("RGBA")
+    return image if image.mode == "RGBA" else image.convert("RGBA")
+
+
+def crossfade_frames(old, new, steps=CROSSFADE_STEPS):
+    '''The frames of a crossfade from the old to the new RGBA art, blended off the Tk main thread, the last one is new'''
+    if old.size != new.size:
+        old = old.resize(new.size, Image.Resampling.BILINEAR)
+    return [Image.blend(old, new, step / steps) for step in range(1, steps)] + [new]
+
+
+class ArtworkResizer:
+    """
+    Decodes album art and resizes it to the screen on a small pool of worker threads.
+    An LRU cache of the resized images, capped at max_bytes, sits in front of the pool, so going
+    back to an album that was shown recently doesn't decode or resize it again. Requests for art
+    that is already being resized share the same Future.
+    """
+    def __init__(self, workers=2, max_bytes=128 * 1024 * 1024):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="artwork")
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.cache = OrderedDict() # (art key, size) -> resized RGBA image, least recently used first
+        self.cache_bytes = 0
+        self.pending = {} # (art key, size) -> Future of the resize in progress
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, key, source, size, trace=None):
+        '''
+        Returns a Future of source resized to size (width, height).
+        key identifies the art, source is a PIL image, a file path, the encoded bytes or a function returning one.
+        trace, if given, is marked when the art is decoded and when it is resized.
+        '''
+        cache_key = (key, size)
+        with self.lock:
+            image = self.cache.get(cache_key)
+            if image is not None:
+                self.cache.move_to_end(cache_key)
+                self.hits += 1
+                future = Future()
+                future.set_result(image)
+                return future
+            future = self.pending.get(cache_key)
+            if future is not None:
+                return future
+            self.misses += 1
+            future = self.pending[cache_key] = self.executor.submit(self._resize, cache_key, source, trace)
+            return future
+
+    def rekey(self, key, new_key):
+        '''Keep the art resized for key under new_key instead, for art whose key is only known once it is decoded'''
+        with self.lock:
+            for cache_key in [cache_key for cache_key in self.cache if cache_key[0] == key]:
+                image = self.cache.pop(cache_key)
+                new_cache_key = (new_key, cache_key[1])
+                if new_cache_key in self.cache:
+                    self.cache_bytes -= image.width * image.height * len(image.getbands())
+                else:
+                    self.cache[new_cache_key] = image
+
+    @profiler.profiled("artwork_resize")
+    def _resize(self, cache_key, source, trace):
+        try:
+            image = decode_image(source)
+            if trace is not None:
+                trace.mark("decoded")
+            size = cache_key[1]
+            if image.size != size:
+                # reducing_gap lets large art be shrunk in a fast first pass before the lanczos filter
+                image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+            if trace is not None:
+                trace.mark("resized")
+        except Exception:
+            with self.lock:
+                self.pending.pop(cache_key, None)
+            raise
+        with self.lock:
+            # cache it before it stops being pending, so nobody starts resizing it again in between
+            self.pending.pop(cache_key, None)
+            self._store(cache_key, image)
+        return image
+
+    def _store(self, cache_key, image):
+        # called with the lock held
+        nbytes = image.width * image.height * len(image.getbands())
+        if nbytes > self.max_bytes or cache_key in self.cache:
+            return
+        self.cache[cache_key] = image
+        self.cache_bytes += nbytes
+        while self.cache_bytes > self.max_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cache_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cached_images": len(self.cache),
+                "cached_bytes": self.cache_bytes,
+                "pending": len(self.pending),
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
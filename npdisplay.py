@@ -1,7 +1,12 @@
-from tkinter import Label, ttk
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from tkinter import Label, font as tkfont, ttk
 from PIL import Image, ImageEnhance, ImageTk
 import logging
 from screensaver import AlbumArtScreensaver
+from nplayout import TextLayout
+from npprofile import profiler
 from nputils import *
 
 try:
@@ -15,9 +20,201 @@ logger = logging.getLogger(__name__)
 if DEBUG:
     logger.setLevel(logging.DEBUG)
 
+# dimmed versions of the current album art kept ready to show, the active, inactive and
+# a couple of dusk dimming levels, each is a full screen image so keep this small
+MAX_ART_VARIANTS = 4
+MAX_RECENT_ART = 3 # albums whose dimmed art is kept, so switching back to one doesn't build its PhotoImages again
+
+FRAME_MS = 20 # interval of the animation clock that drives the text fades
+FRAME_BUDGET = 0.008 # seconds of each frame the fades may use, the rest is left for the UI
+
+FIT_LINES = 3 # the title, artist and album may each fill this many lines of the normal font size
+
+
+def dim_image(image, mask, opaque=True):
+    """
+    Dim an RGBA image as if a black overlay with alpha mask (0 - 255) was composited on top of it.
+    Opaque images are scaled with a lookup table, which gives the same result several times faster.
+    """
+    if mask <= 0:
+        return image
+    if not opaque:
+        overlay = Image.new('RGBA', image.size, (0, 0, 0, mask))
+        return Image.alpha_composite(image, overlay)
+    scale = (255 - mask) / 255
+    channel = [round(value * scale) for value in range(256)]
+    return image.point(channel * 3 + list(range(256)))
+
+
+@lru_cache(maxsize=256)
+def color_ramp(from_color, to_color, steps):
+    '''The colours of a fade from from_color to to_color in steps, the last one is to_color'''
+    start = hex_to_rgb(from_color)
+    end = hex_to_rgb(to_color)
+    return tuple(rgb_to_hex(tuple(int(s + (e - s) * step / steps) for s, e in zip(start, end)))
+                 for step in range(1, steps + 1))
+
+
+class AnimationClock:
+    """
+    Drives all running text fades from a single Tk after() timer.
+    Each label has at most one fade, a new fade on a label replaces the running one. A frame stops
+    early once it has used its budget, the fades it didn't reach go first in the next frame.
+    """
+    def __init__(self, tk_instance, render, frame_ms=FRAME_MS, budget=FRAME_BUDGET):
+        self.tk_instance = tk_instance
+        self.render = render
+        self.frame_ms = frame_ms
+        self.budget = budget
+        self.fades = OrderedDict() # label name -> [label, target colour, frames, index of the next frame]
+        # each frame is a dict of the label options it changes
+        self.after_id = None
+        self.late = 0 # fade steps pushed to a later frame by the budget
+
+    def fade_text(self, label, new_text, background, steps, font=None):
+        '''Fade label out to background, change its text (and font, if given) and fade it back in'''
+        name = str(label)
+        fade = self.fades.pop(name, None)
+        # fade out from the colour the label has now, and back in to the colour
+        # a replaced fade was heading for, not to one of its in between colours
+        target = fade[1] if fade is not None else label.cget("fg")
+        frames = tuple({"fg": color} for color in color_ramp(label.cget("fg"), background, steps))
+        frames += ({"text": new_text, "font": font} if font is not None else {"text": new_text},)
+        frames += tuple({"fg": color} for color in color_ramp(background, target, steps))
+        self.fades[name] = [label, target, frames, 0]
+        if self.after_id is None:
+            self.after_id = self.tk_instance.after(self.frame_ms, self._frame)
+
+    def retarget(self, label, color, background):
+        '''Make a running fade on label fade back in to color, False if label isn't fading'''
+        fade = self.fades.get(str(label))
+        if fade is None:
+            return False
+        if fade[1] != color:
+            steps = len(fade[2]) // 2
+            fade[1] = color
+            fade[2] = fade[2][:steps + 1] + tuple({"fg": c} for c in color_ramp(background, color, steps))
+        return True
+
+    @profiler.profiled("fades")
+    def _frame(self):
+        self.after_id = None
+        deadline = time.perf_counter() + self.budget
+        names = list(self.fades)
+        for done, name in enumerate(names):
+            if time.perf_counter() > deadline:
+                self.late += len(names) - done
+                break
+            fade = self.fades[name]
+            label, _, frames, index = fade
+            self.render.config(label, **frames[index])
+            if index + 1 == len(frames):
+                del self.fades[name]
+            else:
+                fade[3] = index + 1
+                self.fades.move_to_end(name)
+        if self.fades:
+            self.after_id = self.tk_instance.after(self.frame_ms, self._frame)
+
+
+@lru_cache(maxsize=64)
+def time_label_format(duration):
+    """
+    Returns the function that formats the elapsed and duration labels for a track of duration seconds.
+    Both labels use the same format, with as many digits as the duration needs:
+    hh:mm:ss, h:mm:ss, mm:ss or m:ss
+    """
+    if duration >= 36000:
+        return lambda seconds: f"{seconds // 3600:02}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+    if duration >= 3600:
+        return lambda seconds: f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+    if duration >= 600:
+        return lambda seconds: f"{seconds // 60:02}:{seconds % 60:02}"
+    return lambda seconds: f"{seconds // 60}:{seconds % 60:02}"
+
+
+class RenderCache:
+    """
+    Retained state of the Tk widgets: remembers the last value applied to each widget option,
+    and only calls Tk when a value really changes. Counts the calls made and skipped, so steady
+    playback can be checked to do almost no widget work.
+    """
+    def __init__(self):
+        self.applied = {} # (widget name, option) -> value
+        self.styles = {} # (style name, option) -> value
+        self.style = None
+        self.calls = 0
+        self.skipped = 0
+
+    def config(self, widget, **options):
+        '''widget.config(**options), leaving out the options that already have the value'''
+        changed = {}
+        name = str(widget)
+        for option, value in options.items():
+            if self.applied.get((name, option), self) != value:
+                self.applied[(name, option)] = value
+                changed[option] = value
+        if changed:
+            widget.config(**changed)
+            self.calls += 1
+        else:
+            self.skipped += 1
+
+    def configure_style(self, style_name, **options):
+        '''ttk.Style().configure(style_name, **options), leaving out the options that already have the value'''
+        changed = {}
+        for option, value in options.items():
+            if self.styles.get((style_name, option), self) != value:
+                self.styles[(style_name, option)] = value
+                changed[option] = value
+        if changed:
+            if self.style is None:
+                self.style = ttk.Style()
+            self.style.configure(style_name, **changed)
+            self.calls += 1
+        else:
+            self.skipped += 1
+
+    def get_stats(self):
+        return {"render_calls": self.calls, "render_skipped": self.skipped}
+
+
+class DimmedArt:
+    """
+    The undimmed album art, with a cache of the PhotoImages built from it for each mask level.
+    A variant is only built the first time its mask is shown, the source never round trips through Tk.
+    photo_image turns a dimmed PIL image into what the display shows, by default a Tk PhotoImage.
+    """
+    def __init__(self, image, max_variants=MAX_ART_VARIANTS, photo_image=None):
+        self.image = image if image.mode == "RGBA" else image.convert("RGBA")
+        self.opaque = self.image.getextrema()[3][0] == 255
+        self.max_variants = max_variants
+        self.photo_image = photo_image
+        self.variants = OrderedDict() # mask -> PhotoImage, least recently shown first
+        self.built = 0
+
+    def get(self, mask):
+        variant = self.variants.get(mask)
+        if variant is None:
+            photo_image = self.photo_image or ImageTk.PhotoImage
+            variant = self.variants[mask] = photo_image(dim_image(self.image, mask, self.opaque))
+            self.built += 1
+            if len(self.variants) > self.max_variants:
+                self.variants.popitem(last=False)
+        else:
+            self.variants.move_to_end(mask)
+        return variant
+
 
 class NowPlayingDisplay:
     """This class is for creating and updating the objects of the Now Playing screen."""
+    # the widgets are built from these, the headless backend in npheadless swaps in its own
+    Label = Label
+    Progressbar = ttk.Progressbar
+    Style = ttk.Style
+    Screensaver = AlbumArtScreensaver
+    photo_image = None # turns the dimmed art into what art_lbl shows, None for a Tk PhotoImage
+
     def __init__(self, tk_instance, sw, sh):
         self.tk_instance = tk_instance
         self.fontsize = sh // 20
@@ -27,7 +224,15 @@ class NowPlayingDisplay:
         self.mono_fontname = mono_fontname
         self.current_text_color = ACTIVE_TEXT_HEX
         self.current_pgbar_color = ACTIVE_PROGRESS_BAR_COLOR
-        self.active_artwork = None
+        self.active_artwork = None # DimmedArt of the current album art
+        self.recent_artwork = OrderedDict() # art key -> DimmedArt of recently shown art
+        self.shown_art_mask = None # mask of the art variant on the display
+        self.crossfade_after = None # after() id of the next crossfade frame
+        self.render = RenderCache() # all label, progress bar and style changes go through here
+        self.animations = AnimationClock(tk_instance, self.render)
+        self.text_layout = TextLayout(self.measure_text) # font size and line breaks of the title, artist and album
+        self.fit_width = int((sw - sh) - ((sw - sh) * 0.1)) # the wraplength of those labels
+        self.fonts = {} # Tk font tuple -> tkfont.Font used to measure text
         self.screensaver_lock = False
         self.screensaver_after = None
         self.screensaver = None
@@ -58,7 +263,7 @@ class NowPlayingDisplay:
         # )
         # self.title_header_lbl.grid(row=1, column=1, columnspan=3, sticky="sew")
 
-        self.title_lbl = Label(
+        self.title_lbl = self.Label(
             tk_instance,
             text="",
             anchor="nw",
@@ -73,7 +278,7 @@ class NowPlayingDisplay:
         self.title_lbl.grid(row=1, column=1, columnspan=3, sticky="new")
 
         # Artists
-        self.artist_header_lbl = Label(
+        self.artist_header_lbl = self.Label(
             tk_instance,
             text="Artists",
             anchor="sw",
@@ -87,7 +292,7 @@ class NowPlayingDisplay:
         )
         self.artist_header_lbl.grid(row=2, column=1, columnspan=3, sticky="sew")
 
-        self.artist_lbl = Label(
+        self.artist_lbl = self.Label(
             tk_instance,
             text="",
             anchor="nw",
@@ -102,7 +307,7 @@ class NowPlayingDisplay:
         self.artist_lbl.grid(row=3, column=1, columnspan=3, sticky="new")
 
         # Album
-        self.album_header_lbl = Label(
+        self.album_header_lbl = self.Label(
             tk_instance,
             text="Album",
             anchor="w",
@@ -117,7 +322,7 @@ class NowPlayingDisplay:
         self.album_header_lbl.grid(row=4, column=1, columnspan=3, sticky="sew")
 
         #released date
-        self.album_released_lbl = Label(
+        self.album_released_lbl = self.Label(
             tk_instance,
             text="",
             anchor="ne",
@@ -132,7 +337,7 @@ class NowPlayingDisplay:
         self.album_released_lbl.grid(row=5, column=1, columnspan=3, sticky="se")
 
         #album duration
-        self.album_duration_lbl = Label(
+        self.album_duration_lbl = self.Label(
             tk_instance,
             text="",
             anchor="sw",
@@ -147,7 +352,7 @@ class NowPlayingDisplay:
         self.album_duration_lbl.grid(row=5, column=1, columnspan=3, sticky="sw")
 
         #album name
-        self.album_lbl = Label(
+        self.album_lbl = self.Label(
             tk_instance,
             text="",
             anchor="nw",
@@ -163,7 +368,7 @@ class NowPlayingDisplay:
 
         # Track
         #track x of y
-        self.track_lbl = Label(
+        self.track_lbl = self.Label(
             tk_instance,
             text="",
             anchor="nw",
@@ -178,7 +383,7 @@ class NowPlayingDisplay:
         self.track_lbl.grid(row=6, column=1, columnspan=3, sticky="new")
 
         # Elapsed and Duration
-        self.elapsed_lbl = Label(
+        self.elapsed_lbl = self.Label(
             tk_instance,
             text="0:00",
             anchor="sw",
@@ -191,7 +396,7 @@ class NowPlayingDisplay:
         self.elapsed_lbl.grid(row=7, column=1, columnspan=3, sticky="sw")
 
         #Duration of the track
-        self.duration_lbl = Label(
+        self.duration_lbl = self.Label(
             tk_instance,
             text="0:00",
             anchor="se",
@@ -204,7 +409,7 @@ class NowPlayingDisplay:
         self.duration_lbl.grid(row=7, column=1, columnspan=3, sticky="se")
 
         # Progress Bar
-        style = ttk.Style()
+        style = self.render.style = self.Style()
         style.theme_use('default')
         style.configure(
             "Custom.Horizontal.TProgressbar",
@@ -213,150 +418,147 @@ class NowPlayingDisplay:
             troughcolor=BACKGROUND_COLOR,
             borderwidth=0
         )
-        self.progress_bar = ttk.Progressbar(
+        self.progress_bar = self.Progressbar(
             tk_instance,
             orient="horizontal",
             mode="determinate",
             style="Custom.Horizontal.TProgressbar"
         )
-        self.progress_bar.config(length=sw, value=0, maximum=100)
+        # the bar counts in pixels, so it only changes when a pixel of it does
+        self.progress_pixels = max(1, sw - sh)
+        self.progress_bar.config(length=sw, value=0, maximum=self.progress_pixels)
         self.progress_bar.grid(row=8, column=1, columnspan=3, sticky="es", ipady=sh//300)
 
         # Full Screen Album Art goes here!
-        self.art_lbl = Label(
+        self.art_lbl = self.Label(
             tk_instance,
             image=None,
             bg=BACKGROUND_COLOR
         )
         self.art_lbl.grid(row=1, column=0, rowspan=8, sticky="nswe", padx=0, pady=0)
 
-    def _time_to_seconds(self, time_str):
-        try:
-            parts = list(map(int, str(time_str).split(':')))
-            if len(parts) == 3:
-                hours, minutes, seconds = parts
-            elif len(parts) == 2:
-                hours = 0
-                minutes, seconds = parts
-            else:
-                return 0
-            return hours * 3600 + minutes * 60 + seconds
-        except:
-            return 0
-
-    def _update_progress_bar(self, elapsed):
-        # Convert elapsed and duration to seconds
-        elapsed_seconds = self._time_to_seconds(elapsed)
-        duration_seconds = self._time_to_seconds(self.get_duration())
-
-        if duration_seconds == 0:
-            self.progress_bar["value"] = 0
-            return
-        else:
-            percentage_elapsed = (elapsed_seconds / duration_seconds) * 100
-            self.progress_bar["value"] = percentage_elapsed
-
     def get_duration(self):
         return self.duration_lbl.cget("text")
 
     def set_debug(self, debug):
         self.DEBUG = debug
 
-    def set_duration_and_elapsed(self, duration, new_elapsed):
-        if duration is not None: #split duration into hh mm ss
-            parts = duration.split(':')
-            if len(parts) == 3:  # "hh:mm:ss" format
-                dur_h, dur_m, dur_s = parts
-            elif len(parts) == 2:  # "mm:ss" format
-                dur_h, dur_m, dur_s = 0, *parts
-            else:
-                dur_h, dur_m, dur_s = 0, 0, 0
-        else:
-            dur_h, dur_m, dur_s = 0, 0, 0
-
-        if new_elapsed is not None: #split elapsed into hh mm ss
-            parts =  new_elapsed.split(':')
-            if len(parts) == 3:  # "hh:mm:ss" format
-                elap_h, elap_m, elap_s = parts
-            elif len(parts) == 2:  # "mm:ss" format
-                elap_h, elap_m, elap_s = 0, *parts
-            else:
-                elap_h, elap_m, elap_s = 0, 0, 0
-        else:
-            elap_h, elap_m, elap_s = 0, 0, 0
-
-        #want to make sure that duration and elapsed have the same format
-        #m:ss - m:ss
-        #mm:ss - mm:ss
-        #h:mm:ss - mm:ss
-        #hh:mm:ss - hh:mm:ss
-
-        if len(str(dur_h).lstrip('0')) == 2: #10+ hours long
-            dur_label_text = f"{int(dur_h):02}:{int(dur_m):02}:{int(dur_s):02}"
-            elap_label_text = f"{int(elap_h):02}:{int(elap_m):02}:{int(elap_s):02}"
-        elif len(str(dur_h).lstrip('0')) == 1: #1-9 hours long
-            dur_label_text = f"{int(dur_h):1}:{int(dur_m):02}:{int(dur_s):02}"
-            elap_label_text = f"{int(elap_h):1}:{int(elap_m):02}:{int(elap_s):02}"
-        elif len(str(dur_m).lstrip('0')) == 2: #10-59 minutes long")
-            dur_label_text = f"{int(dur_m):02}:{int(dur_s):02}"
-            elap_label_text = f"{int(elap_m):02}:{int(elap_s):02}"
-        else: #less than 10 minutes long
-            dur_label_text = f"{int(dur_m):1}:{int(dur_s):02}"
-            elap_label_text = f"{int(elap_m):1}:{int(elap_s):02}"
-
-        self.elapsed_lbl.config(text=elap_label_text)
-        self.duration_lbl.config(text=dur_label_text)
-
-        # update progress bar with new elapsed time
-        self._update_progress_bar(new_elapsed)
+    def get_render_stats(self):
+        '''
+        Counts of the widget updates sent to Tk, of those skipped because nothing changed, of late fade steps
+        and of the text layouts
+        '''
+        stats = self.render.get_stats()
+        stats["fade_steps_late"] = self.animations.late
+        stats.update(self.text_layout.get_stats())
+        return stats
+
+    def measure_text(self, font, text):
+        '''Width of text in pixels when shown in font, a Tk font tuple'''
+        measurer = self.fonts.get(font)
+        if measurer is None:
+            measurer = self.fonts[font] = tkfont.Font(root=self.tk_instance, font=font)
+        return measurer.measure(text)
+
+    @profiler.profiled("text_layout")
+    def fit_text(self, label, new_text, font):
+        # shrink the font from its normal size, down to TEXT_MIN_SIZE_FRACTION of it, until the text fits
+        size, new_text = self.text_layout.fit(new_text, font, self.fit_width, FIT_LINES,
+                                              max(1, int(font[1] * TEXT_MIN_SIZE_FRACTION)))
+        self.fade_text(label, new_text, font=(font[0], size) + font[2:])
+
+    @profiler.profiled("progress")
+    def set_duration_and_elapsed(self, duration, elapsed):
+        # duration and elapsed are whole seconds, this is the only place they are formatted
+        label_format = time_label_format(duration)
+        self.render.config(self.elapsed_lbl, text=label_format(elapsed))
+        self.render.config(self.duration_lbl, text=label_format(duration))
+
+        # update progress bar with new elapsed time, to the pixel
+        self.render.config(self.progress_bar, value=elapsed * self.progress_pixels // duration if duration > 0 else 0)
     
     def set_title(self, new_title):
-        self.fade_text(self.title_lbl, new_title)
+        self.fit_text(self.title_lbl, new_title, (self.fontname, self.fontsize, "bold"))
 
     def set_artist(self, new_artist):
-        self.fade_text(self.artist_lbl, new_artist)
+        self.fit_text(self.artist_lbl, new_artist, (self.fontname, self.fontsize))
         if "\n" in new_artist:
             self.fade_text(self.artist_header_lbl, "Artists")
         else:
             self.fade_text(self.artist_header_lbl, "Artist")
 
     def set_album(self, new_album):
-        self.fade_text(self.album_lbl, new_album)
+        self.fit_text(self.album_lbl, new_album, (self.fontname, self.fontsize))
         self.fade_text(self.album_header_lbl, "Album")
 
     def set_album_released(self, new_album_released):
-        self.album_released_lbl.config(text=new_album_released)
+        self.render.config(self.album_released_lbl, text=new_album_released)
     
     def set_album_duration(self, new_album_duration):
-        self.album_duration_lbl.config(text=new_album_duration)
-
-    def set_artwork(self, active_artwork):
+        self.render.config(self.album_duration_lbl, text=new_album_duration)
+
+    def set_artwork(self, active_artwork, key=None):
+        # active_artwork is a PIL image, already sized for the display
+        # key identifies the art, the PhotoImages of recently shown art are kept and used again
+        if self.crossfade_after is not None:
+            # other art replaces a running crossfade
+            self.tk_instance.after_cancel(self.crossfade_after)
+            self.crossfade_after = None
         if active_artwork is not None:
-            self.active_artwork = active_artwork
+            artwork = self.recent_artwork.get(key) if key is not None else None
+            if artwork is None or artwork.image.size != active_artwork.size:
+                artwork = DimmedArt(active_artwork, photo_image=self.photo_image)
+                if key is not None:
+                    self.recent_artwork[key] = artwork
+                    if len(self.recent_artwork) > MAX_RECENT_ART:
+                        self.recent_artwork.popitem(last=False)
+            elif key is not None:
+                self.recent_artwork.move_to_end(key)
+            self.active_artwork = artwork
+            self.shown_art_mask = None
             self.set_active_art_with_mask(calculate_dimming_mask())
 
+    def crossfade_artwork(self, frames, key=None, duration=ART_CROSSFADE_MS):
+        '''
+        Show the frames of a crossfade from the art on the display to new art over duration milliseconds,
+        see npartwork.crossfade_frames(). The last frame is the new art, it is set with set_artwork() and key.
+        '''
+        frames = list(frames)
+        self.set_artwork(None) # stops a running crossfade
+        self._crossfade_frame(frames, key, max(1, duration // len(frames)))
+
+    @profiler.profiled("art")
+    def _crossfade_frame(self, frames, key, frame_ms):
+        self.crossfade_after = None
+        image = frames.pop(0)
+        if not frames:
+            self.set_artwork(image, key)
+            return
+        # the in between frames are shown once, they aren't kept like the DimmedArt variants
+        photo_image = self.photo_image or ImageTk.PhotoImage
+        tkimage = photo_image(dim_image(image, calculate_dimming_mask(), image.getextrema()[3][0] == 255))
+        self.art_lbl.config(image=tkimage)
+        self.art_lbl.image = tkimage
+        self.shown_art_mask = None
+        self.crossfade_after = self.tk_instance.after(frame_ms, self._crossfade_frame, frames, key, frame_ms)
+
     def set_track(self, track_text):
-        self.track_lbl.config(text=track_text)
+        self.render.config(self.track_lbl, text=track_text)
 
     def _update_foreground(self):
-        # Update the text color of the labels
-        self.album_header_lbl.config(fg=self.current_text_color)
-        self.album_lbl.config(fg=self.current_text_color)
-        self.album_released_lbl.config(fg=self.current_text_color)
-        self.album_duration_lbl.config(fg=self.current_text_color)
-        self.artist_header_lbl.config(fg=self.current_text_color)
-        self.artist_lbl.config(fg=self.current_text_color)
-        self.title_lbl.config(fg=self.current_text_color)
-        self.track_lbl.config(fg=self.current_text_color)
-        self.elapsed_lbl.config(fg=self.current_text_color)
-        self.duration_lbl.config(fg=self.current_text_color)
+        # Update the text color of the labels, only the ones that changed reach Tk
+        for label in (self.album_header_lbl, self.album_lbl, self.album_released_lbl, self.album_duration_lbl,
+                      self.artist_header_lbl, self.artist_lbl, self.title_lbl, self.track_lbl,
+                      self.elapsed_lbl, self.duration_lbl):
+            # a fading label gets the new colour when it fades back in
+            if not self.animations.retarget(label, self.current_text_color, BACKGROUND_COLOR):
+                self.render.config(label, fg=self.current_text_color)
         # Update the progress bar style's background color
-        style = ttk.Style()
-        style.configure("Custom.Horizontal.TProgressbar", background=self.current_pgbar_color)
+        self.render.configure_style("Custom.Horizontal.TProgressbar", background=self.current_pgbar_color)
 
     def start_screensaver(self, delay):
         self.screensaver_lock = True
-        self.screensaver = AlbumArtScreensaver(debug=self.DEBUG)
+        self.screensaver = self.Screensaver(debug=self.DEBUG)
         self.screensaver_after = self.tk_instance.after(delay*1000, self.screensaver.start)
 
     def _stop_screensaver(self):
@@ -402,55 +604,22 @@ class NowPlayingDisplay:
     def set_current_pbar_color(self, color):
         self.current_pgbar_color = color
 
+    @profiler.profiled("art")
     def set_active_art_with_mask(self, mask):
         """
         Dim the image by applying a semi-transparent black overlay.
-        dim_percentage: float between 0 (no dimming) and 100 (full dimming)
+        mask: int between 0 (no dimming) and 255 (full dimming)
+        Nothing is done if the art on the display already has this mask.
         """
-        if self.active_artwork is not None:
-            # Convert the Tkinter PhotoImage back to a PIL Image
-            pil_image = ImageTk.getimage(self.active_artwork)
-            
-            # Create a black overlay with the desired opacity
-            overlay = Image.new('RGBA', pil_image.size, (0, 0, 0, mask))
-            
-            # Apply the overlay on top of the original image
-            dimmed_image = Image.alpha_composite(pil_image, overlay)
-            
-            # Convert back to a PhotoImage for Tkinter
-            dimmed_tkimage = ImageTk.PhotoImage(dimmed_image)
+        if self.active_artwork is not None and mask != self.shown_art_mask:
+            dimmed_tkimage = self.active_artwork.get(mask)
 
             # Update the label's image in place
             self.art_lbl.config(image=dimmed_tkimage)
             self.art_lbl.image = dimmed_tkimage  # Keep a reference to avoid garbage collection
+            self.shown_art_mask = mask
 
-    def fade_text(self, label, new_text, duration=200, steps=10):
-        delay = duration // steps  # Delay between each step in milliseconds
-        initial_color = label.cget("fg")  # Get the current foreground color
-        faded_out_color = BACKGROUND_COLOR # Match background for fading out effect
-
-        def fade_step(step):
-            if step < steps:
-                # Fade out
-                color = self.interpolate_color(initial_color, faded_out_color, step / steps)
-                label.config(fg=color)
-                self.tk_instance.after(delay, fade_step, step + 1)
-            elif step == steps:
-                # Change text when fully faded out
-                label.config(text=new_text)
-                self.tk_instance.after(delay, fade_step, step + 1)
-            elif step < 2 * steps:
-                # Fade in
-                color = self.interpolate_color(faded_out_color, initial_color, (step - steps) / steps)
-                label.config(fg=color)
-                self.tk_instance.after(delay, fade_step, step + 1)
-
-        # Start the fade
-        fade_step(0)
-
-    def interpolate_color(self, color1, color2, t):
-        """ Linearly interpolate between two colors. t goes from 0 to 1. """
-        color1_rgb = hex_to_rgb(color1)
-        color2_rgb = hex_to_rgb(color2)
-        interp_rgb = tuple(int(c1 + (c2 - c1) * t) for c1, c2 in zip(color1_rgb, color2_rgb))
-        return rgb_to_hex(interp_rgb)
\ No newline at end of file
+    def fade_text(self, label, new_text, duration=200, font=None):
+        # duration is the time to fade out, and again to fade back in, in milliseconds
+        steps = max(1, duration // self.animations.frame_ms)
+        self.animations.fade_text(label, new_text, BACKGROUND_COLOR, steps, font)
@@ -0,0 +1,100 @@
+import asyncio
+import queue
+from threading import Lock
+
+from nppayload import dumps
+
+
+class Subscription:
+    """A Server-Sent Events subscriber served from a thread (the Flask server)"""
+    def __init__(self, backlog):
+        self.messages = queue.Queue(maxsize=backlog)
+
+    def deliver(self, message):
+        # a slow subscriber loses its oldest messages instead of holding up the others
+        while True:
+            try:
+                self.messages.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self.messages.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        '''Return the next encoded message, or None if none arrived within timeout seconds'''
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """A Server-Sent Events subscriber served from an asyncio event loop (the asgi server)"""
+    def __init__(self, backlog, loop):
+        self.messages = asyncio.Queue(maxsize=backlog)
+        self.loop = loop
+
+    def deliver(self, message):
+        # called from the display thread, hand the message over to the event loop
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message):
+        if self.messages.full():
+            self.messages.get_nowait()
+        self.messages.put_nowait(message)
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroadcaster:
+    """
+    Fans out now playing events to any number of Server-Sent Events subscribers.
+    Each event is serialized once and the same encoded message is handed to every subscriber.
+    New subscribers get the latest track and position events straight away.
+    Messages are delivered with the lock held, so every subscriber gets them in the order they were
+    published, and the latest events can't overtake a newer one. Delivering never blocks.
+    """
+    def __init__(self, max_subscribers=64, backlog=16):
+        self.max_subscribers = max_subscribers
+        self.backlog = backlog
+        self.lock = Lock()
+        self.subscribers = set()
+        self.latest = {} # event name -> latest encoded message
+
+    def publish(self, event, data):
+        message = b"event: " + event.encode("utf-8") + b"\ndata: " + dumps(data) + b"\n\n"
+        with self.lock:
+            self.latest[event] = message
+            for subscriber in self.subscribers:
+                subscriber.deliver(message)
+
+    def _add(self, subscriber):
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+            for message in self.latest.values():
+                subscriber.deliver(message)
+        return subscriber
+
+    def subscribe(self):
+        '''Return a new Subscription, or None if there are already max_subscribers'''
+        return self._add(Subscription(self.backlog))
+
+    def subscribe_async(self, loop):
+        '''Return a new AsyncSubscription for the event loop, or None if there are already max_subscribers'''
+        return self._add(AsyncSubscription(self.backlog, loop))
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def get_subscriber_count(self):
+        with self.lock:
+            return len(self.subscribers)
@@ -0,0 +1,104 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from npprofile import profiler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.55 Safari/537.36"
+RETRY_STATUS = (429, 500, 502, 503, 504) # answers worth asking again, 429 waits for its Retry-After, up to the read timeout
+
+
+class _CappedRetry(Retry):
+    # a Retry-After is honoured for at most max_retry_after seconds, servers may ask for hours
+    # (retry_after_max does the same, but only in newer versions of urllib3)
+    def __init__(self, *args, max_retry_after=10.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs):
+        # urllib3 makes a new Retry after every attempt
+        retry = super().new(**kwargs)
+        retry.max_retry_after = self.max_retry_after
+        return retry
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, self.max_retry_after)
+
+
+class ArtworkFetcher:
+    """
+    Downloads album art and album pages on a small pool of worker threads, so the display loop never waits on the network.
+    The workers share one requests session, which keeps the connections to each host alive between
+    downloads. Every request has a connect and a read timeout, and is retried a few times with a
+    backoff on connection errors and busy servers before it fails. Requests for a url that is already
+    being downloaded share the same Future, so two payloads for the same art download it once.
+    """
+    def __init__(self, workers=4, connect_timeout=3.0, read_timeout=10.0, retries=2):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+        self.timeout = (connect_timeout, read_timeout)
+        retry = _CappedRetry(total=retries, backoff_factor=0.5, status_forcelist=RETRY_STATUS, allowed_methods=("GET",),
+                             respect_retry_after_header=True, max_retry_after=read_timeout)
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = Lock()
+        self.pending = {} # url -> Future of the download in progress
+        self.requests = 0
+        self.shared = 0
+        self.failures = 0
+        self.bytes = 0
+
+    def fetch(self, url):
+        '''Returns a Future of the body of url as bytes, it raises a requests exception if the download failed'''
+        with self.lock:
+            future = self.pending.get(url)
+            if future is not None:
+                self.shared += 1
+                return future
+            self.requests += 1
+            future = self.pending[url] = self.executor.submit(self._download, url)
+            return future
+
+    def get(self, url):
+        '''The body of url as bytes, waiting for the download'''
+        return self.fetch(url).result()
+
+    @profiler.profiled("fetch")
+    def _download(self, url):
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.content
+        except Exception as e:
+            logger.warning(f"failed to download {url}: {e}")
+            with self.lock:
+                self.pending.pop(url, None)
+                self.failures += 1
+            raise
+        with self.lock:
+            self.pending.pop(url, None)
+            self.bytes += len(data)
+        return data
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "shared": self.shared,
+                "failures": self.failures,
+                "bytes": self.bytes,
+                "pending": len(self.pending),
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,416 @@
+import heapq
+import itertools
+import logging
+import select
+import time
+from functools import lru_cache
+from tkinter import READABLE
+
+from PIL import Image, ImageDraw, ImageFont
+
+from npdisplay import NowPlayingDisplay
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+POINT_PIXELS = 96 / 72 # Tk font sizes are in points, at the usual 96 dpi
+PROGRESS_BAR_THICKNESS = 15 # height of a ttk progress bar before its ipady
+
+
+@lru_cache(maxsize=32)
+def load_font(name, size, bold=False):
+    '''The font for a Tk font description, Pillow's own font when the font isn't installed'''
+    pixels = max(1, round(size * POINT_PIXELS))
+    for filename in ((f"{name}-Bold.ttf", f"{name}Bold.ttf") if bold else ()) + (name, f"{name}.ttf", f"{name}-Regular.ttf"):
+        try:
+            return ImageFont.truetype(filename, pixels)
+        except OSError:
+            pass
+    return ImageFont.load_default(pixels)
+
+
+def get_font(font):
+    # font is a Tk font tuple: (name, size) or (name, size, "bold")
+    return load_font(font[0], font[1], "bold" in font[2:])
+
+
+@lru_cache(maxsize=1024)
+def wrap_text(text, font, wraplength):
+    '''Break text into lines no wider than wraplength pixels at the spaces, the way a Tk label does'''
+    face = get_font(font)
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if line and wraplength and face.getlength(candidate) > wraplength:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return tuple(lines)
+
+
+@lru_cache(maxsize=1024)
+def text_size(lines, font):
+    '''Width and height of the lines of text in pixels'''
+    face = get_font(font)
+    ascent, descent = face.getmetrics()
+    width = max((face.getlength(line) for line in lines), default=0)
+    return int(width), (ascent + descent) * len(lines)
+
+
+class HeadlessWidget:
+    """Records the options and the grid placement of a widget, like the Tk widget it stands in for"""
+    ids = itertools.count(1)
+
+    def __init__(self, master, **options):
+        self.master = master
+        self.options = dict(self.defaults)
+        self.options.update(options)
+        self.name = f".!{type(self).__name__.lower()}{next(self.ids)}"
+        self.grid_options = None
+
+    def __str__(self):
+        return self.name
+
+    def config(self, **options):
+        self.options.update(options)
+        self.master.invalidate(self)
+
+    configure = config
+
+    def cget(self, option):
+        return self.options[option]
+
+    def grid(self, **options):
+        self.grid_options = options
+        self.master.add_widget(self)
+
+    def get_size(self):
+        '''The size the widget asks the grid for'''
+        return 0, 0
+
+    def draw(self, frame, draw, box):
+        pass
+
+
+class HeadlessLabel(HeadlessWidget):
+    defaults = {"text": "", "image": None, "font": ("TkDefaultFont", 10), "fg": "#000000", "bg": "#000000",
+                "anchor": "center", "justify": "center", "wraplength": 0, "padx": 0, "pady": 0}
+
+    def get_lines(self):
+        return wrap_text(self.options["text"], self.options["font"], int(self.options["wraplength"]))
+
+    def get_size(self):
+        image = self.options["image"]
+        if image is not None:
+            width, height = image.size
+        else:
+            width, height = text_size(self.get_lines(), self.options["font"])
+        return width + 2 * self.options["padx"], height + 2 * self.options["pady"]
+
+    def draw(self, frame, draw, box):
+        left, top, right, bottom = box
+        draw.rectangle(box, fill=self.options["bg"])
+        image = self.options["image"]
+        if image is not None:
+            width, height = image.size
+        else:
+            lines = self.get_lines()
+            width, height = text_size(lines, self.options["font"])
+        # place the content in the box by the anchor, inside the padding
+        anchor = self.options["anchor"]
+        padx, pady = self.options["padx"], self.options["pady"]
+        x = left + padx if "w" in anchor else right - padx - width if "e" in anchor else (left + right - width) // 2
+        y = top + pady if "n" in anchor else bottom - pady - height if "s" in anchor else (top + bottom - height) // 2
+        if image is not None:
+            frame.paste(image, (x, y))
+        elif lines != ("",):
+            align = {"center": "center", "right": "right"}.get(self.options["justify"], "left")
+            draw.multiline_text((x, y), "\n".join(lines), font=get_font(self.options["font"]),
+                                fill=self.options["fg"], align=align, spacing=0)
+
+
+class HeadlessProgressbar(HeadlessWidget):
+    defaults = {"value": 0, "maximum": 100, "length": 100, "style": "", "orient": "horizontal", "mode": "determinate"}
+
+    def get_size(self):
+        return self.options["length"], PROGRESS_BAR_THICKNESS + 2 * self.grid_options.get("ipady", 0)
+
+    def draw(self, frame, draw, box):
+        style = self.master.styles.get(self.options["style"], {})
+        draw.rectangle(box, fill=style.get("troughcolor", "#000000"))
+        left, top, right, bottom = box
+        fraction = min(1, max(0, self.options["value"] / self.options["maximum"]))
+        if fraction > 0:
+            draw.rectangle((left, top, left + round((right - left) * fraction), bottom),
+                           fill=style.get("background", "#000000"))
+
+
+class HeadlessStyle:
+    """ttk.Style for the headless root, the progress bar reads its colours from here"""
+    def __init__(self, master):
+        self.master = master
+
+    def theme_use(self, theme=None):
+        pass
+
+    def configure(self, style_name, **options):
+        self.master.styles.setdefault(style_name, {}).update(options)
+        self.master.invalidate(None)
+
+
+class HeadlessScreensaver:
+    """The screensaver opens its own Tk window, headless the display just stays dimmed instead"""
+    def __init__(self, debug=False):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class HeadlessRoot:
+    """
+    Stands in for the Tk root window, without a display.
+    Keeps the after() timers and runs them from mainloop(), and lays out the widgets on its grid into
+    an in-memory PIL frame whenever they changed, at the same points Tk redraws the window.
+    Like Tk, it is only used from the thread running mainloop(), other threads post to the UICommandQueue.
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.options = {"bg": "#000000"}
+        self.row_weights = {} # row -> weight
+        self.widgets = [] # in the order they were put on the grid, later ones are drawn on top
+        self.styles = {} # style name -> options
+        self.timers = [] # heap of (due time, id, function, args)
+        self.cancelled = set()
+        self.file_handlers = {} # fd -> function called when it is readable
+        self.ids = itertools.count(1)
+        self.running = False
+        self.dirty = set() # names of the widgets changed since the last frame, None for a layout change
+        self.live = set() # names of the widgets drawn over the base frame when only they changed
+        self.frame = None
+        self.base = None # the frame without the live widgets
+        self.layout = {} # widget name -> box
+        self.frames = 0
+        self.partial_frames = 0
+        self.render_seconds = 0.0
+
+    # the parts of the Tk root the display uses
+    def winfo_screenwidth(self):
+        return self.width
+
+    def winfo_screenheight(self):
+        return self.height
+
+    def title(self, title):
+        pass
+
+    def attributes(self, *args):
+        pass
+
+    def focus_force(self):
+        pass
+
+    def lift(self):
+        pass
+
+    def config(self, **options):
+        self.options.update(options)
+        self.invalidate(None)
+
+    configure = config
+
+    def columnconfigure(self, index, weight=0):
+        pass
+
+    def rowconfigure(self, index, weight=0):
+        self.row_weights[index] = weight
+        self.invalidate(None)
+
+    def after(self, ms, function, *args):
+        after_id = f"after#{next(self.ids)}"
+        heapq.heappush(self.timers, (time.monotonic() + ms / 1000, after_id, function, args))
+        return after_id
+
+    def after_cancel(self, after_id):
+        if after_id is not None:
+            self.cancelled.add(after_id)
+
+    def update_idletasks(self):
+        '''Draw the frame if any widget changed'''
+        if self.dirty:
+            self.render()
+
+    def update(self):
+        self._run_timers()
+        self.update_idletasks()
+
+    def createfilehandler(self, fd, mask, function):
+        '''Call function(fd, mask) from the mainloop when fd is readable, like Tk's file handlers'''
+        self.file_handlers[fd] = function
+
+    def deletefilehandler(self, fd):
+        self.file_handlers.pop(fd, None)
+
+    def mainloop(self):
+        self.running = True
+        while self.running:
+            self.update()
+            delay = self.timers[0][0] - time.monotonic() if self.timers else 0.05
+            if delay > 0:
+                # sleep until the next timer, or until a watched file is readable
+                if not self.file_handlers:
+                    time.sleep(min(delay, 0.05))
+                    continue
+                readable, _, _ = select.select(list(self.file_handlers), [], [], min(delay, 0.05))
+                for fd in readable:
+                    self.file_handlers[fd](fd, READABLE)
+
+    def quit(self):
+        self.running = False
+
+    def destroy(self):
+        self.quit()
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, after_id, function, args = heapq.heappop(self.timers)
+            if after_id in self.cancelled:
+                self.cancelled.discard(after_id)
+                continue
+            function(*args)
+
+    # the widgets
+    def add_widget(self, widget):
+        if widget not in self.widgets:
+            self.widgets.append(widget)
+        self.invalidate(None)
+
+    def invalidate(self, widget):
+        self.dirty.add(None if widget is None else widget.name)
+
+    def set_live(self, widgets):
+        '''Widgets that change often and never change the layout, only they are redrawn when only they changed'''
+        self.live = {widget.name for widget in widgets}
+
+    def get_frame(self):
+        '''The frame as it is on the screen now, a PIL RGB image'''
+        self.update_idletasks()
+        return self.frame
+
+    def render(self):
+        start = time.perf_counter()
+        if self.base is not None and self.dirty <= self.live:
+            self.partial_frames += 1
+        else:
+            self.layout = self._layout()
+            self.base = Image.new("RGB", (self.width, self.height), self.options["bg"])
+            draw = ImageDraw.Draw(self.base)
+            for widget in self.widgets:
+                if widget.name not in self.live:
+                    widget.draw(self.base, draw, self.layout[widget.name])
+        self.dirty.clear()
+        frame = self.base.copy()
+        draw = ImageDraw.Draw(frame)
+        for widget in self.widgets:
+            if widget.name in self.live:
+                widget.draw(frame, draw, self.layout[widget.name])
+        self.frame = frame
+        self.frames += 1
+        self.render_seconds += time.perf_counter() - start
+
+    def _layout(self):
+        # a simplified Tk grid: columns 0 and 1, column 0 as wide as its widgets and column 1 the rest,
+        # rows as tall as their widgets and the height left over shared by row weight
+        rows = sorted(set(self.row_weights) | {w.grid_options.get("row", 0) for w in self.widgets})
+        heights = dict.fromkeys(rows, 0)
+        column_width = 0
+        for widget in self.widgets:
+            width, height = widget.get_size()
+            if widget.grid_options.get("column", 0) == 0:
+                column_width = max(column_width, width)
+            if widget.grid_options.get("rowspan", 1) == 1:
+                row = widget.grid_options.get("row", 0)
+                heights[row] = max(heights[row], height)
+        spare = self.height - sum(heights.values())
+        total_weight = sum(self.row_weights.get(row, 0) for row in rows)
+        if spare > 0 and total_weight:
+            for row in rows:
+                heights[row] += spare * self.row_weights.get(row, 0) // total_weight
+        tops = {}
+        top = 0
+        for row in rows:
+            tops[row] = top
+            top += heights[row]
+
+        layout = {}
+        for widget in self.widgets:
+            options = widget.grid_options
+            row = options.get("row", 0)
+            rowspan = options.get("rowspan", 1)
+            cell_top = tops[row]
+            cell_bottom = cell_top + sum(heights[r] for r in rows if row <= r < row + rowspan)
+            cell_left, cell_right = (0, column_width) if options.get("column", 0) == 0 else (column_width, self.width)
+            width, height = widget.get_size()
+            sticky = options.get("sticky", "")
+            if "w" in sticky and "e" in sticky:
+                left, right = cell_left, cell_right
+            else:
+                width = min(width, cell_right - cell_left)
+                left = cell_left if "w" in sticky else cell_right - width if "e" in sticky else (cell_left + cell_right - width) // 2
+                right = left + width
+            if "n" in sticky and "s" in sticky:
+                top, bottom = cell_top, cell_bottom
+            else:
+                top = cell_top if "n" in sticky else cell_bottom - height if "s" in sticky else (cell_top + cell_bottom - height) // 2
+                bottom = top + height
+            layout[widget.name] = (left, top, right, bottom)
+        return layout
+
+    def get_stats(self):
+        return {
+            "frames": self.frames,
+            "partial_frames": self.partial_frames,
+            "render_seconds": round(self.render_seconds, 6),
+        }
+
+
+class HeadlessDisplay(NowPlayingDisplay):
+    """
+    NowPlayingDisplay rendering into the in-memory frames of a HeadlessRoot instead of a Tk window.
+    Everything but the widgets is the real display, so the same fades, render cache and art dimming run.
+    """
+    Label = HeadlessLabel
+    Progressbar = HeadlessProgressbar
+    Screensaver = HeadlessScreensaver
+
+    def Style(self):
+        return HeadlessStyle(self.tk_instance)
+
+    def photo_image(self, image):
+        # what a PhotoImage holds, the pixels without the alpha channel
+        return image.convert("RGB")
+
+    def __init__(self, tk_instance, sw, sh):
+        super().__init__(tk_instance, sw, sh)
+        # position ticks only redraw the elapsed time, the duration and the progress bar
+        tk_instance.set_live((self.elapsed_lbl, self.duration_lbl, self.progress_bar))
+
+    def measure_text(self, font, text):
+        return get_font(font).getlength(text)
+
+    def get_render_stats(self):
+        stats = super().get_render_stats()
+        stats.update(self.tk_instance.get_stats())
+        return stats
+
+    def get_frame(self):
+        return self.tk_instance.get_frame()
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+
+
+def preferred_break(text):
+    '''Break a long title before its first parenthesis, or after its first colon'''
+    if " (" in text:
+        first, rest = text.split(" (", 1)
+        return f"{first}\n({rest}"
+    if ": " in text:
+        first, rest = text.split(": ", 1)
+        return f"{first}:\n{rest}"
+    return text
+
+
+class TextLayout:
+    """
+    Picks the font size and line breaks that fit a text in a box, by measuring the text.
+
+    Every word is measured once, at the largest font size, and smaller sizes scale those widths, so
+    finding the size is a binary search without any more measurements. A new text costs one
+    measurement for each word that wasn't measured before, and one for the space. Finished layouts
+    are kept by (text, font, width, lines), so showing a track or album again costs nothing.
+    measure(font, text) returns the width of text in pixels, font is a Tk font tuple.
+    """
+    def __init__(self, measure, max_layouts=256, max_words=4096):
+        self.measure = measure
+        self.max_layouts = max_layouts
+        self.max_words = max_words
+        self.layouts = OrderedDict() # (text, font, width, max_lines, min_size) -> (size, text with line breaks)
+        self.words = OrderedDict() # (font, word) -> width at the font's size
+        self.hits = 0
+        self.misses = 0
+        self.measurements = 0
+
+    def fit(self, text, font, width, max_lines, min_size):
+        '''
+        Returns (size, text) of the largest size from font[1] down to min_size that fits text in
+        width pixels and the height of max_lines lines of font, with the line breaks put in.
+        Text that doesn't fit even at min_size is wrapped at min_size and may overflow.
+        '''
+        key = (text, font, width, max_lines, min_size)
+        layout = self.layouts.get(key)
+        if layout is not None:
+            self.layouts.move_to_end(key)
+            self.hits += 1
+            return layout
+        self.misses += 1
+        layout = self._fit(text, font, width, max_lines, min_size)
+        self.layouts[key] = layout
+        if len(self.layouts) > self.max_layouts:
+            self.layouts.popitem(last=False)
+        return layout
+
+    def _fit(self, text, font, width, max_lines, min_size):
+        largest = font[1]
+        lines = self._wrap(text, font, width)
+        if lines is not None and len(lines) == text.count("\n") + 1 and len(lines) <= max_lines:
+            return largest, text # fits on its lines as it is
+        broken = preferred_break(text)
+        # a smaller font fits more on a line, and more lines in the same height
+        low, high = min(min_size, largest), largest
+        best = None
+        while low <= high:
+            size = (low + high) // 2
+            lines = self._wrap(broken, font, width * largest / size)
+            if lines is not None and len(lines) * size <= max_lines * largest:
+                best = size, lines
+                low = size + 1
+            else:
+                high = size - 1
+        if best is None:
+            size = min(min_size, largest)
+            best = size, self._wrap(broken, font, width * largest / size, overflow=True)
+        return best[0], "\n".join(best[1])
+
+    def _wrap(self, text, font, width, overflow=False):
+        # greedy line breaks at the spaces, width is in pixels of the font's own size
+        # None if a single word is wider than width, unless overflow allows it
+        space = self._width(font, " ")
+        lines = []
+        for paragraph in text.split("\n"):
+            line, line_width = [], 0
+            for word in paragraph.split(" "):
+                word_width = self._width(font, word)
+                if word_width > width and not overflow:
+                    return None
+                if line and line_width + space + word_width > width:
+                    lines.append(" ".join(line))
+                    line, line_width = [word], word_width
+                else:
+                    line_width += (space if line else 0) + word_width
+                    line.append(word)
+            lines.append(" ".join(line))
+        return lines
+
+    def _width(self, font, word):
+        key = (font, word)
+        width = self.words.get(key)
+        if width is None:
+            width = self.words[key] = self.measure(font, word)
+            self.measurements += 1
+            if len(self.words) > self.max_words:
+                self.words.popitem(last=False)
+        return width
+
+    def get_stats(self):
+        return {"layout_hits": self.hits, "layout_misses": self.misses, "layout_measurements": self.measurements}
@@ -7,8 +7,9 @@ logging.basicConfig(level=logging.INFO)
 logger=logging.getLogger(__name__)
 
 class MusicBrainzSearch:
-    def __init__(self, artists, album, title, duration, debug=False):
+    def __init__(self, artists, album, title, duration, debug=False, store=None):
         self.debug = debug
+        self.store = store # an npartstore.ArtworkStore for the front cover, or None to save it as <release_id>.jpg
         if self.debug:
             logger.setLevel(logging.DEBUG)
         self.search_artists = artists
@@ -27,6 +28,7 @@ class MusicBrainzSearch:
         self.front_cover = None
         self.back_cover = None
         self.art_path = ""
+        self.art_digest = None # hash of the front cover in the store
         self.succeeded = False
         self._setup()
         if self._search_recordings():
@@ -117,10 +119,13 @@ class MusicBrainzSearch:
         if self.release_data['release']['cover-art-archive']['front'] == 'true':
             try:
                 self.front_cover = musicbrainzngs.get_image_front(self.release_id)
-                # save the front cover image to the album_images directory
-                logger.debug(f"Saving cover image to {self.art_path}{self.release_id}.jpg")
-                with open(f'{self.art_path}{self.release_id}.jpg', 'wb') as file:
-                    file.write(self.front_cover)
+                if self.store is not None:
+                    self.art_digest = self.store.put(self.front_cover, aliases=(f"musicbrainz:{self.release_id}",))
+                else:
+                    # save the front cover image to the album_images directory
+                    logger.debug(f"Saving cover image to {self.art_path}{self.release_id}.jpg")
+                    with open(f'{self.art_path}{self.release_id}.jpg', 'wb') as file:
+                        file.write(self.front_cover)
             except:
                 self.front_cover = None
         if self.release_data['release']['cover-art-archive']['back'] == 'true':
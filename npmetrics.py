@@ -0,0 +1,139 @@
+import itertools
+import time
+from threading import Lock
+
+# latency buckets in seconds, from a queued heartbeat up to a slow album art download
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# stages a payload passes through on its way to the display, a payload only reaches the stages
+# its update needs, position heartbeats go straight from dequeued to rendered
+STAGES = ("received", "dequeued", "resolved", "decoded", "resized", "rendered")
+
+# the stats (without their prefix) that are a level that goes up and down, exposed as gauges
+# every other stat counts up from the start and is exposed as a counter named with _total
+GAUGES = frozenset(("pending", "pending_clients", "cached_images", "cached_bytes",
+                    "disk_files", "disk_bytes", "memory_images", "memory_bytes"))
+
+
+class Trace:
+    """
+    Monotonic timestamps of one payload passing through the stages, from the moment the API
+    received it until the display rendered it.
+    """
+    __slots__ = ("trace_id", "times")
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.times = {"received": time.monotonic()}
+
+    def mark(self, stage):
+        self.times[stage] = time.monotonic()
+
+    def get_durations(self):
+        '''Seconds spent reaching each stage from the stage before it, in the order they happened'''
+        marks = sorted(self.times.items(), key=lambda item: item[1])
+        return [(stage, end - start) for (_, start), (stage, end) in zip(marks, marks[1:])]
+
+    def get_total(self):
+        return max(self.times.values()) - self.times["received"]
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, in the shape Prometheus expects"""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class LatencyMetrics:
+    """
+    Collects the stage timings of finished traces into per stage histograms, and renders them
+    in the Prometheus text format for the /metrics endpoint.
+    Traces are started by the API threads and finished by the display loop.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = Lock()
+        self.ids = itertools.count(1)
+        self.stages = {} # stage -> Histogram of the time spent reaching it
+        self.latency = {} # payload kind -> Histogram of received to rendered
+        self.traces = 0
+        self.sources = [] # (prefix, callable returning a dict of counters) added with add_counters()
+
+    def add_counters(self, prefix, get_stats):
+        '''Expose the dict returned by get_stats() on every render, each name prefixed with prefix, see GAUGES'''
+        self.sources.append((prefix, get_stats))
+
+    def new_trace(self):
+        # the prefix keeps trace ids unique across restarts of the display
+        return Trace(f"{int(time.time()):x}-{next(self.ids):x}")
+
+    def finish(self, trace, kind):
+        '''Record a trace that reached the display, kind is the payload type'''
+        if "rendered" not in trace.times:
+            trace.mark("rendered")
+        durations = trace.get_durations()
+        total = trace.get_total()
+        with self.lock:
+            self.traces += 1
+            for stage, seconds in durations:
+                if stage not in self.stages:
+                    self.stages[stage] = Histogram(self.buckets)
+                self.stages[stage].observe(seconds)
+            if kind not in self.latency:
+                self.latency[kind] = Histogram(self.buckets)
+            self.latency[kind].observe(total)
+
+    def render(self, counters=None):
+        '''Prometheus text exposition, counters is an optional list of extra (prefix, stats dict) to expose like add_counters()'''
+        with self.lock:
+            lines = [
+                "# HELP nowplaying_stage_seconds Time a payload took to reach each stage from the previous one.",
+                "# TYPE nowplaying_stage_seconds histogram",
+            ]
+            for stage in sorted(self.stages, key=lambda stage: STAGES.index(stage) if stage in STAGES else len(STAGES)):
+                lines.extend(self.stages[stage].render("nowplaying_stage_seconds", f'stage="{stage}"'))
+            lines.extend([
+                "# HELP nowplaying_update_latency_seconds Time from the API receiving a payload until the display rendered it.",
+                "# TYPE nowplaying_update_latency_seconds histogram",
+            ])
+            for kind in sorted(self.latency):
+                lines.extend(self.latency[kind].render("nowplaying_update_latency_seconds", f'kind="{kind}"'))
+            lines.extend([
+                "# HELP nowplaying_traces_total Payloads traced all the way to the display.",
+                "# TYPE nowplaying_traces_total counter",
+                f"nowplaying_traces_total {self.traces}",
+            ])
+        sources = list(counters or ()) + [(prefix, get_stats()) for prefix, get_stats in self.sources]
+        for prefix, stats in sources:
+            for name, value in stats.items():
+                if name in GAUGES:
+                    lines.append(f"# TYPE nowplaying_{prefix}{name} gauge")
+                    lines.append(f"nowplaying_{prefix}{name} {value}")
+                else:
+                    lines.append(f"# TYPE nowplaying_{prefix}{name}_total counter")
+                    lines.append(f"nowplaying_{prefix}{name}_total {value}")
+        return "\n".join(lines) + "\n"
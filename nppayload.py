@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+try:
+    # orjson is optional, it parses payloads several times faster than the json module
+    import orjson
+
+    JSON_BACKEND = "orjson"
+    loads = orjson.loads
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:
+    import json
+
+    JSON_BACKEND = "json"
+    loads = json.loads
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode("utf-8")
+
+# api protocol versions, version 1 payloads have no "v" field and are always full track payloads
+# version 2 adds the "type" field: "track" payloads carry the metadata, and small "position"
+# heartbeats only carry the elapsed time, player state and a sequence number
+PROTOCOL_VERSIONS = (1, 2)
+TRACK_KEYS = frozenset(("album", "artist", "title", "duration", "elapsed", "state", "npclient"))
+POSITION_KEYS = frozenset(("elapsed", "state", "npclient"))
+STATE_ALIASES = {"active": "playing"}
+
+
+class PayloadError(ValueError):
+    """Raised when a posted payload can't be used, the message is sent back to the client"""
+
+
+def parse_time(value):
+    '''Convert "hh:mm:ss", "mm:ss" or a number of seconds to whole seconds, anything else is 0'''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return max(0, int(value))
+    if isinstance(value, str):
+        try:
+            seconds = 0
+            for part in value.split(':', 2):
+                seconds = seconds * 60 + int(part)
+            return max(0, seconds)
+        except ValueError:
+            return 0
+    return 0
+
+
+def format_time(seconds):
+    '''Format whole seconds as "m:ss", or "h:mm:ss" when an hour or longer'''
+    minutes, seconds = divmod(seconds, 60)
+    if minutes >= 60:
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+@lru_cache(maxsize=4096)
+def _parse_time_text(value):
+    # clients send the same few thousand time strings over and over, parse each one once
+    seconds = parse_time(value)
+    return seconds, format_time(seconds)
+
+
+def _time(value):
+    # returns (seconds, normalized text)
+    if type(value) is str:
+        return _parse_time_text(value)
+    seconds = parse_time(value)
+    return seconds, format_time(seconds)
+
+
+def _text(data, key):
+    value = data.get(key)
+    if type(value) is str:
+        return value
+    if value is None:
+        return ""
+    raise PayloadError(f"Invalid {key}")
+
+
+def _artist(value):
+    # a list of names, or a single string that may hold several comma separated artists
+    if type(value) is list:
+        artist = tuple(value)
+        for name in artist:
+            if type(name) is not str:
+                raise PayloadError("Invalid artist")
+        return artist
+    if type(value) is str:
+        return tuple(name.strip() for name in value.split(",")) if value else ()
+    if value is None:
+        return ()
+    raise PayloadError("Invalid artist")
+
+
+@dataclass(frozen=True)
+class NextTrack:
+    """The track a client will play next, from the optional "next" block of a track payload"""
+    title: str
+    artist: tuple
+    album: str
+    art_url: str
+
+
+def _next_track(data):
+    value = data.get("next")
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise PayloadError("Invalid next")
+    next_track = NextTrack(_text(value, "title"), _artist(value.get("artist")), _text(value, "album"), _text(value, "art_url"))
+    return next_track if next_track.title else None
+
+
+class NowPlayingPayload:
+    """
+    A validated api payload, built once per request by parse_payload().
+    Times are kept both as the normalized text and as whole seconds.
+    next is the NextTrack the client says comes after this one, or None.
+    trace is the npmetrics.Trace following the payload to the display, or None.
+    """
+    __slots__ = ("version", "kind", "seq", "npclient", "state", "elapsed", "elapsed_seconds",
+                 "album", "artist", "title", "duration", "duration_seconds", "art_url", "quality", "next", "trace")
+
+    def is_position(self):
+        return self.kind == "position"
+
+    def track_key(self):
+        '''The fields that identify what a client is playing, everything else is just position'''
+        return (self.title, self.album, self.artist, self.state)
+
+    def metadata(self):
+        '''What the payload says about the track, without the position, player state and sequence number'''
+        return (self.kind, self.npclient, self.album, self.artist, self.title, self.duration_seconds,
+                self.art_url, self.quality, self.next)
+
+
+def parse_payload(body):
+    '''
+    Decode, validate and normalize a payload in a single pass.
+    body is the raw request body, or an already decoded dict. Raises PayloadError.
+    '''
+    if isinstance(body, dict):
+        data = body
+    else:
+        try:
+            data = loads(body)
+        except ValueError:
+            raise PayloadError("Invalid JSON payload")
+        if not isinstance(data, dict):
+            raise PayloadError("Invalid payload")
+
+    payload = NowPlayingPayload()
+    payload.trace = None
+    payload.version = data.get("v", 1)
+    if payload.version not in PROTOCOL_VERSIONS:
+        raise PayloadError("Unsupported protocol version")
+    payload.kind = data.get("type", "track") if payload.version > 1 else "track"
+    if payload.kind == "position":
+        required = POSITION_KEYS
+    elif payload.kind == "track":
+        required = TRACK_KEYS
+    else:
+        raise PayloadError("Invalid payload type")
+    # require all keys in the payload to be present
+    if not data.keys() >= required:
+        raise PayloadError("Invalid payload")
+
+    seq = data.get("seq")
+    if seq is not None and type(seq) is not int:
+        raise PayloadError("Invalid seq")
+    payload.seq = seq
+    payload.npclient = _text(data, "npclient")
+    state = _text(data, "state").lower()
+    payload.state = STATE_ALIASES.get(state, state)
+    payload.elapsed_seconds, payload.elapsed = _time(data["elapsed"])
+
+    if payload.kind == "position":
+        payload.album = payload.title = payload.duration = payload.art_url = payload.quality = ""
+        payload.artist = ()
+        payload.duration_seconds = 0
+        payload.next = None
+        return payload
+
+    payload.artist = _artist(data["artist"])
+    payload.album = _text(data, "album")
+    payload.title = _text(data, "title")
+    payload.duration_seconds, payload.duration = _time(data["duration"])
+    payload.art_url = _text(data, "art_url")
+    payload.quality = _text(data, "quality")
+    payload.next = _next_track(data)
+    return payload
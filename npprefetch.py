@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from threading import Lock
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PREFETCH_NICE = 10 # how much lower the prefetch thread's priority is than the display's
+
+
+def _lower_priority():
+    # on Linux a thread has its own nice value, so the display loop and Tk keep theirs
+    try:
+        thread_id = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, thread_id, os.getpriority(os.PRIO_PROCESS, thread_id) + PREFETCH_NICE)
+    except (AttributeError, OSError) as e:
+        logger.debug(f"prefetch thread keeps its priority: {e}")
+
+
+class TrackPrefetcher:
+    """
+    Finds the album art and data of the track a player plays next before it starts, so skipping to it is a cache hit.
+    resolve(snap) does the work for a snapshot of the next track and returns what the display loop
+    would have resolved itself. It runs on a single low priority thread. Only the newest next track
+    is kept: submitting another one, or taking a different track, drops the work done for it.
+    """
+    def __init__(self, resolve):
+        self.resolve = resolve
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch", initializer=_lower_priority)
+        self.lock = Lock()
+        self.key = None # identifies the prefetched track, (npclient, title, album)
+        self.future = None # Future of resolve() for it
+        self.submitted = 0
+        self.hits = 0
+        self.late = 0 # taken before they were ready
+        self.dropped = 0
+
+    def submit(self, key, snap):
+        '''Start finding the art and data of the track in snap, unless it is the one already prefetched'''
+        with self.lock:
+            if key == self.key:
+                return
+            self._drop()
+            self.key = key
+            self.future = self.executor.submit(self.resolve, snap)
+            self.submitted += 1
+
+    def take(self, key):
+        '''
+        What resolve() returned for the track key, never waits: the display loop must keep ticking.
+        None if the track wasn't prefetched, is still being prefetched or prefetching it failed, the prefetched
+        track is dropped then. The caller resolves the track itself, downloads in flight are shared by the fetcher.
+        '''
+        with self.lock:
+            if self.future is None:
+                return None
+            if key != self.key:
+                self._drop()
+                return None
+            if not self.future.done():
+                self.late += 1
+                self._drop()
+                return None
+            future = self.future
+            self.key = self.future = None
+        try:
+            resolved = future.result()
+        except CancelledError:
+            return None
+        except Exception as e:
+            logger.error(f"failed to prefetch {key}: {e}")
+            return None
+        with self.lock:
+            self.hits += 1
+        return resolved
+
+    def _drop(self):
+        # called with the lock held, work that hasn't started yet is cancelled, a running resolve() is left to finish and ignored
+        if self.future is not None:
+            self.future.cancel()
+            self.dropped += 1
+        self.key = self.future = None
+
+    def get_stats(self):
+        with self.lock:
+            return {"submitted": self.submitted, "hits": self.hits, "late": self.late, "dropped": self.dropped}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,136 @@
+import functools
+import threading
+import time
+from collections import deque
+
+# operations the display spends its time on, the names used for the spans
+# display_loop: one iteration of np_mainloop after it woke up, state_update: reading the new state
+# ui_commands: running posted commands on the Tk main thread, art: building and showing dimmed art
+# fades: a frame of the text fades, progress: the elapsed time and progress bar
+# tk_update: Tk drawing the changes, artwork_resize: decoding and resizing art on the pool
+# fetch: downloading art or an album page on the fetcher's pool
+
+
+class _NoSpan:
+    # returned while profiling is off, entering and leaving it does nothing
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "wall", "cpu", "children")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.children = 0.0 # wall time of the spans nested in this one
+
+    def __enter__(self):
+        self.profiler._push(self)
+        self.wall = time.perf_counter()
+        self.cpu = time.thread_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.thread_time() - self.cpu
+        self.profiler._pop(self, wall, cpu)
+        return False
+
+
+class DisplayProfiler:
+    """
+    Opt-in profiler of the display loop and the Tk main thread.
+    Code wraps its operations in span(name), spans nest per thread. The wall and CPU time of each
+    finished span is kept in a ring buffer of the last size spans, which can be dumped as a summary
+    table or as folded stacks for flame graph tools. While disabled span() returns a shared object
+    that does nothing, so the hooks can stay in the hot paths.
+    """
+    def __init__(self, enabled=False, size=10000):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.spans = deque(maxlen=size) # (stack, wall, cpu, self wall) of the finished spans, oldest first
+        self.local = threading.local()
+
+    def set_enabled(self, enabled, size=None):
+        with self.lock:
+            self.enabled = enabled
+            if size is not None and size != self.spans.maxlen:
+                self.spans = deque(self.spans, maxlen=size)
+
+    def span(self, name):
+        '''Context manager timing the code it wraps as name'''
+        if not self.enabled:
+            return NO_SPAN
+        return _Span(self, name)
+
+    def profiled(self, name):
+        '''Decorator timing every call of the function as name'''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with _Span(self, name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _push(self, span):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(span)
+
+    def _pop(self, span, wall, cpu):
+        stack = self.local.stack
+        names = tuple(s.name for s in stack)
+        stack.pop()
+        if stack:
+            stack[-1].children += wall
+        with self.lock:
+            self.spans.append((names, wall, cpu, wall - span.children))
+
+    def clear(self):
+        with self.lock:
+            self.spans.clear()
+
+    def get_spans(self):
+        with self.lock:
+            return list(self.spans)
+
+    def get_folded(self):
+        '''The time spent in each stack itself, in microseconds, in the folded format flamegraph.pl and speedscope read'''
+        totals = {}
+        for names, _, _, self_wall in self.get_spans():
+            totals[names] = totals.get(names, 0.0) + self_wall
+        return "".join(f"{';'.join(names)} {round(seconds * 1e6)}\n" for names, seconds in sorted(totals.items()))
+
+    def get_summary(self):
+        '''A table of the count, wall and CPU time of each operation, the most wall time first'''
+        operations = {} # name -> [count, wall, max wall, cpu]
+        for names, wall, cpu, _ in self.get_spans():
+            totals = operations.get(names[-1])
+            if totals is None:
+                totals = operations[names[-1]] = [0, 0.0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] = max(totals[2], wall)
+            totals[3] += cpu
+        lines = [f"{'operation':<24}{'count':>8}{'wall ms':>12}{'mean ms':>10}{'max ms':>10}{'cpu ms':>12}"]
+        for name, (count, wall, longest, cpu) in sorted(operations.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<24}{count:>8}{wall * 1000:>12.2f}{wall * 1000 / count:>10.3f}"
+                         f"{longest * 1000:>10.3f}{cpu * 1000:>12.2f}")
+        return "\n".join(lines) + "\n"
+
+
+# shared by the display loop, the display and the artwork pool, enabled with PROFILE_DISPLAY
+profiler = DisplayProfiler()
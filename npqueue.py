@@ -0,0 +1,213 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from npprofile import profiler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PayloadQueue:
+    """
+    Bounded, thread-safe channel for api payloads.
+    The API threads put() payloads and the display loop blocks in get() until one
+    arrives or its deadline passes, so an idle display loop does not need to poll.
+
+    Payloads are coalesced per npclient with latest-wins semantics: at most one state
+    payload (a new track or player state) and one heartbeat (a position payload, or the
+    same track with a new elapsed time) wait for each client, older ones are dropped and counted.
+    """
+    def __init__(self, maxclients=16):
+        self.maxclients = maxclients
+        self.pending = OrderedDict() # npclient -> {"state": payload, "heartbeat": payload}
+        self.last_track = OrderedDict() # npclient -> track_key of the newest state payload
+        self.condition = threading.Condition()
+        self.received = 0
+        self.dropped_states = 0
+        self.dropped_heartbeats = 0
+        self.dropped_clients = 0
+
+    def put(self, payload):
+        # payload is a NowPlayingPayload from nppayload.parse_payload()
+        npclient = payload.npclient
+        key = payload.track_key()
+        with self.condition:
+            self.received += 1
+            slot = self.pending.get(npclient)
+            if slot is None:
+                if len(self.pending) >= self.maxclients:
+                    # too many clients waiting, drop the one that has waited the longest
+                    _, evicted = self.pending.popitem(last=False)
+                    self.dropped_states += evicted["state"] is not None
+                    self.dropped_heartbeats += evicted["heartbeat"] is not None
+                    self.dropped_clients += 1
+                slot = self.pending[npclient] = {"state": None, "heartbeat": None}
+
+            if payload.is_position() or self.last_track.get(npclient) == key:
+                # a position heartbeat, or the same track as the newest state with only the position changed
+                if slot["heartbeat"] is not None:
+                    self.dropped_heartbeats += 1
+                    if (payload.seq or 0) < (slot["heartbeat"].seq or 0):
+                        # arrived out of order, the waiting heartbeat is newer
+                        return
+                slot["heartbeat"] = payload
+            else:
+                # a new state makes any older state and heartbeat stale
+                if slot["state"] is not None:
+                    self.dropped_states += 1
+                if slot["heartbeat"] is not None:
+                    self.dropped_heartbeats += 1
+                    slot["heartbeat"] = None
+                slot["state"] = payload
+                self.last_track[npclient] = key
+                self.last_track.move_to_end(npclient)
+                if len(self.last_track) > self.maxclients:
+                    self.last_track.popitem(last=False)
+            self.condition.notify()
+
+    def _pop(self):
+        npclient, slot = next(iter(self.pending.items()))
+        if slot["state"] is not None:
+            payload, slot["state"] = slot["state"], None
+        else:
+            payload, slot["heartbeat"] = slot["heartbeat"], None
+        if slot["state"] is None and slot["heartbeat"] is None:
+            del self.pending[npclient]
+        return payload
+
+    def get(self, timeout=None):
+        '''
+        Remove and return the next payload, waiting up to timeout seconds for one to arrive.
+        A timeout of None waits forever, 0 never waits. Returns None if no payload arrived in time.
+        '''
+        with self.condition:
+            if not self.pending:
+                if timeout is not None and timeout <= 0:
+                    return None
+                if not self.condition.wait_for(lambda: len(self.pending) > 0, timeout):
+                    return None
+            payload = self._pop()
+        if payload.trace is not None:
+            payload.trace.mark("dequeued")
+        return payload
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                "received": self.received,
+                "dropped_states": self.dropped_states,
+                "dropped_heartbeats": self.dropped_heartbeats,
+                "dropped_clients": self.dropped_clients,
+                "pending_clients": len(self.pending),
+            }
+
+    def __len__(self):
+        with self.condition:
+            return sum((slot["state"] is not None) + (slot["heartbeat"] is not None) for slot in self.pending.values())
+
+
+class UICommandQueue:
+    """
+    Hands work for the Tk widgets from other threads to the Tk main thread.
+    Worker threads post() commands, the main thread runs them in order from a Tk after() timer,
+    so only the main thread ever touches Tk.
+
+    A command posted with a key replaces the command with the same key that is still waiting,
+    and moves to the back of the queue, so a stalled main thread only ever catches up on the
+    latest position or track instead of every one it missed.
+
+    While the queue stays empty the main thread checks it less and less often, up to every
+    max_idle_ms, so an idle display hardly wakes up. The first command posted then wakes it straight
+    away through a pipe the Tk root watches. Roots that can't watch a file (Tk on Windows) are
+    checked every interval_ms instead.
+    """
+    def __init__(self, interval_ms=10, budget=0.02, max_idle_ms=250):
+        self.interval_ms = interval_ms # how often the main thread checks for commands
+        self.budget = budget # seconds the main thread runs commands for before handling Tk events again
+        self.max_idle_ms = max_idle_ms
+        self.idle_ms = interval_ms # how long the main thread waits before checking the empty queue again
+        self.commands = OrderedDict() # key -> (function, args)
+        self.ids = itertools.count() # keys for the commands posted without one
+        self.lock = threading.Lock()
+        self.tk_instance = None
+        self.after_id = None
+        self.wake_fd = None # write end of the pipe that wakes the main thread, None if the root can't watch it
+        self.sleeping = False # the main thread backed off, the next post() wakes it
+        self.replaced = 0
+        self.wakeups = 0
+
+    def post(self, function, *args, key=None):
+        '''Run function(*args) on the Tk main thread, can be called from any thread'''
+        with self.lock:
+            if key is None:
+                key = next(self.ids)
+            elif key in self.commands:
+                del self.commands[key]
+                self.replaced += 1
+            self.commands[key] = (function, args)
+            wake = self.sleeping
+            self.sleeping = False
+        if wake:
+            try:
+                os.write(self.wake_fd, b"\0")
+            except BlockingIOError:
+                pass # the pipe is full of wakeups already
+
+    def start(self, tk_instance):
+        '''Start running the posted commands, called on the Tk main thread before tk.mainloop()'''
+        self.tk_instance = tk_instance
+        # Tk has the file handlers on its interpreter, the headless root on itself
+        watcher = getattr(tk_instance, "tk", tk_instance)
+        if hasattr(watcher, "createfilehandler"):
+            # imported here, the clients import this module on hosts without tkinter
+            from tkinter import READABLE
+            read_fd, self.wake_fd = os.pipe()
+            os.set_blocking(self.wake_fd, False)
+            watcher.createfilehandler(read_fd, READABLE, self._wake)
+        self.after_id = tk_instance.after(self.interval_ms, self._drain)
+
+    def _wake(self, fd, mask):
+        # runs on the main thread when post() found it backing off
+        os.read(fd, 4096)
+        self.wakeups += 1
+        self.tk_instance.after_cancel(self.after_id)
+        self._drain()
+
+    @profiler.profiled("ui_commands")
+    def _drain(self):
+        deadline = time.perf_counter() + self.budget
+        ran = False
+        while time.perf_counter() < deadline:
+            with self.lock:
+                if not self.commands:
+                    break
+                _, (function, args) = self.commands.popitem(last=False)
+            ran = True
+            try:
+                with profiler.span(getattr(function, '__name__', "command")):
+                    function(*args)
+            except Exception as e:
+                logger.error(f"ui command {getattr(function, '__name__', function)} failed: {e}")
+        with self.lock:
+            if self.commands:
+                # with commands left over, give Tk a moment for its own events and carry on
+                delay = 1
+                self.idle_ms = self.interval_ms
+            elif ran or self.wake_fd is None:
+                delay = self.idle_ms = self.interval_ms
+            else:
+                delay = self.idle_ms = min(self.idle_ms * 2, self.max_idle_ms)
+            self.sleeping = delay > self.interval_ms
+        self.after_id = self.tk_instance.after(delay, self._drain)
+
+    def get_stats(self):
+        with self.lock:
+            return {"pending": len(self.commands), "replaced": self.replaced, "wakeups": self.wakeups}
+
+    def __len__(self):
+        with self.lock:
+            return len(self.commands)
@@ -0,0 +1,70 @@
+import math
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter with a bucket per key.
+    Each bucket holds up to burst tokens and refills at rate tokens per second, every request
+    takes a token. Only the max_keys most recently seen keys are tracked, so a flood of new keys
+    can't grow it without limit. A rate of 0 disables the limiter.
+    """
+    def __init__(self, rate, burst, max_keys=1024):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self.lock = Lock()
+        self.buckets = OrderedDict() # key -> [tokens, time of the last refill]
+        self.limited = 0
+
+    def acquire(self, key):
+        '''Take a token for key, returns 0 if allowed or the seconds until a token is available'''
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.limited += 1
+            return (1 - bucket[0]) / self.rate
+
+    def get_limited(self):
+        return self.limited
+
+
+class IngestRateLimiter:
+    """
+    Rate limits for /update-now-playing, a bucket for each source address and another for each npclient.
+    The address is checked before the body is parsed, so a flood is turned away as cheaply as possible.
+    """
+    def __init__(self, client_rate, client_burst, address_rate, address_burst, max_keys=1024):
+        self.clients = RateLimiter(client_rate, client_burst, max_keys)
+        self.addresses = RateLimiter(address_rate, address_burst, max_keys)
+
+    def check_address(self, address):
+        '''Returns 0 if address may post, or the whole seconds it should wait (for Retry-After)'''
+        if address is None:
+            return 0
+        return math.ceil(self.addresses.acquire(address))
+
+    def check_client(self, npclient):
+        '''Returns 0 if npclient may post, or the whole seconds it should wait (for Retry-After)'''
+        return math.ceil(self.clients.acquire(npclient))
+
+    def get_stats(self):
+        return {
+            "limited_addresses": self.addresses.get_limited(),
+            "limited_clients": self.clients.get_limited(),
+        }
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+
+from nppayload import PayloadError, dumps, parse_payload
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EVENTS_KEEP_ALIVE = 15 # seconds between keep-alive comments on an idle /events stream
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8" # prometheus text format
+
+
+def ingest_payload(players, body, metrics=None, limiter=None, address=None):
+    '''
+    Parse and validate a payload posted to /update-now-playing and queue it for the display loop.
+    body is the raw request body. Shared by the Flask and asgi API servers, returns the response
+    message and status code. With metrics (an npmetrics.LatencyMetrics) the payload gets a trace,
+    and its id is returned to the client. With limiter (an npratelimit.IngestRateLimiter) clients
+    over their rate are answered with 429 before anything is queued, address is the source address.
+    '''
+    trace = metrics.new_trace() if metrics is not None else None
+    if limiter is not None:
+        retry_after = limiter.check_address(address)
+        if retry_after:
+            return rate_limited(retry_after)
+    try:
+        payload = parse_payload(body)
+    except PayloadError as e:
+        logger.debug(f"invalid payload ({e}): {body}")
+        return {"message": str(e)}, 400
+    if limiter is not None:
+        retry_after = limiter.check_client(payload.npclient)
+        if retry_after:
+            return rate_limited(retry_after)
+    if payload.is_position() and not players.knows(payload.npclient):
+        # the display doesn't know what this client is playing yet
+        return {"message": "Unknown track, send a track payload"}, 409
+    message = {"message": "Payload received successfully"}
+    if trace is not None:
+        payload.trace = trace
+        message["trace"] = trace.trace_id
+        logger.debug(f"trace {trace.trace_id}: {payload.kind} payload from {payload.npclient}")
+    players.add_api_payload(payload)
+    return message, 200
+
+
+def rate_limited(retry_after):
+    return {"message": "Too many requests", "retry_after": retry_after}, 429
+
+
+def response_headers(message, status):
+    '''Extra headers for an ingest_payload() response'''
+    if status == 429:
+        return [("Retry-After", str(message["retry_after"]))]
+    return []
+
+
+def metrics_text(metrics, players, limiter=None):
+    '''The /metrics page, latency histograms along with the payload queue and rate limiter counters'''
+    counters = [("queue_", players.get_payload_stats())]
+    if limiter is not None:
+        counters.append(("", limiter.get_stats()))
+    return metrics.render(counters)
+
+
+def profile_text(profiler, fmt=None):
+    '''The /profile page, a summary table or with fmt "folded" the folded stacks. None while profiling is off'''
+    if profiler is None or not profiler.enabled:
+        return None
+    if fmt == "folded":
+        return profiler.get_folded()
+    return profiler.get_summary()
+
+
+class AsyncIngestApp:
+    """
+    ASGI application that serves the NowPlayingDisplay API from a single asyncio event loop.
+    Payloads are validated and queued directly on the event loop, the html pages are rendered
+    on a small bounded pool of worker threads because they read from sqlite, and /events
+    streams are fed from the EventBroadcaster without a thread per subscriber.
+    """
+    def __init__(self, players, pages, events=None, max_body=64 * 1024, page_workers=4, metrics=None, limiter=None,
+                 profiler=None):
+        self.players = players
+        self.pages = pages # path -> callable returning the rendered html
+        self.events = events
+        self.metrics = metrics
+        self.limiter = limiter
+        self.profiler = profiler
+        self.max_body = max_body
+        self.page_workers = page_workers
+        self.page_slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"]
+        method = scope["method"]
+        if path == "/update-now-playing":
+            if method != "POST":
+                await self._send_json(send, {"message": "Method not allowed"}, 405)
+                return
+            body = await self._read_body(receive)
+            if body is None:
+                await self._send_json(send, {"message": "Payload too large"}, 413)
+                return
+            logger.debug(f"api received: {body}")
+            client = scope.get("client")
+            message, status = ingest_payload(self.players, body, self.metrics, self.limiter, client[0] if client else None)
+            await self._send_json(send, message, status, response_headers(message, status))
+        elif path == "/metrics" and self.metrics is not None and method == "GET":
+            text = metrics_text(self.metrics, self.players, self.limiter)
+            await self._send(send, 200, text.encode("utf-8"), METRICS_CONTENT_TYPE.encode("ascii"))
+        elif path == "/profile" and method == "GET":
+            query = scope.get("query_string", b"").decode("latin-1")
+            fmt = "folded" if "format=folded" in query.split("&") else None
+            text = profile_text(self.profiler, fmt)
+            if text is None:
+                await self._send_json(send, {"message": "Profiling is disabled"}, 404)
+            else:
+                await self._send(send, 200, text.encode("utf-8"), b"text/plain; charset=utf-8")
+        elif path in self.pages and method in ("GET", "HEAD"):
+            if self.page_slots is None:
+                self.page_slots = asyncio.Semaphore(self.page_workers)
+            async with self.page_slots:
+                html = await asyncio.get_running_loop().run_in_executor(None, self.pages[path])
+            await self._send(send, 200, html.encode("utf-8"), b"text/html; charset=utf-8")
+        elif path == "/events" and self.events is not None and method == "GET":
+            await self._stream_events(receive, send)
+        else:
+            await self._send(send, 404, b"Not Found", b"text/plain")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _stream_events(self, receive, send):
+        subscription = self.events.subscribe_async(asyncio.get_running_loop())
+        if subscription is None:
+            await self._send_json(send, {"message": "Too many subscribers"}, 503)
+            return
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                ],
+            })
+            while True:
+                # wait for the next message, but stop as soon as the client goes away
+                getter = asyncio.create_task(subscription.get(EVENTS_KEEP_ALIVE))
+                await asyncio.wait((getter, watcher), return_when=asyncio.FIRST_COMPLETED)
+                if watcher.done():
+                    getter.cancel()
+                    break
+                message = getter.result()
+                await send({"type": "http.response.body", "body": message or b": keep-alive\n\n", "more_body": True})
+        except OSError:
+            pass # client went away mid write
+        finally:
+            watcher.cancel()
+            self.events.unsubscribe(subscription)
+
+    async def _read_body(self, receive):
+        # returns None if the body is larger than max_body
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > self.max_body:
+                return None
+            more_body = message.get("more_body", False)
+        return body
+
+    async def _send_json(self, send, message, status, headers=()):
+        await self._send(send, status, dumps(message), b"application/json", headers)
+
+    async def _send(self, send, status, body, content_type, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode("ascii")),
+            ] + [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def run_asgi(app, host, port, max_concurrency=64, keep_alive=30):
+    '''Serve an asgi app with uvicorn, blocks until the server exits'''
+    try:
+        import uvicorn
+    except ImportError:
+        logger.error("uvicorn is not installed, it is required for API_SERVER = \"asgi\"")
+        raise
+    config = uvicorn.Config(
+        app,
+        host=host,
+        port=port,
+        limit_concurrency=max_concurrency, # answer 503 instead of queueing without limit
+        timeout_keep_alive=keep_alive,
+        log_level="error"
+    )
+    uvicorn.Server(config).run()
@@ -10,13 +10,39 @@ npapi_address = "192.168.1.xxx" #this should be the IP address of the computer r
 wiim_address = "192.168.1.xxx" #this should be the IP address of your WiiM, if you are using one
 tidal_client = "my-tidal"
 
+API_SERVER = "flask" #"flask" for the threaded Flask server, or "asgi" for the asyncio server (requires uvicorn)
+API_MAX_CONCURRENCY = 64 #asgi only: the most connections and requests served at once, more are answered with 503
+API_KEEP_ALIVE = 30 #asgi only: seconds an idle keep-alive connection stays open
+MAX_EVENT_SUBSCRIBERS = 64 #the most web clients that can follow the /events stream at once
+# with the Flask server each subscriber uses a thread, with the asgi server they also count towards API_MAX_CONCURRENCY
+API_CLIENT_RATE = 2 #payloads per second each npclient may post, set to 0 to disable the limit
+API_CLIENT_BURST = 10 #payloads an npclient may post at once before API_CLIENT_RATE applies
+API_ADDRESS_RATE = 10 #payloads per second each source IP address may post, for all of its npclients together
+API_ADDRESS_BURST = 30
+# a client over its limit is answered with 429 and a Retry-After header, nothing it sends reaches the display loop
+
 screensaver_delay = 200 #the number of seconds before the screensaver starts
 
 MAX_STORED_ALBUM_IMAGES = 10000
+ART_WORKERS = 2 #threads that decode and resize album art for the display
+ART_CACHE_MB = 128 #memory for album art already resized for the display, going back to a recent album is instant
+ART_STORE_MB = 1024 #disk space for downloaded album art in album_images, the least recently shown art is removed first
+ART_MEMORY_MB = 64 #memory for decoded album art, in front of the art on disk
+ART_FETCH_WORKERS = 4 #album art and album pages downloaded at once, the display keeps running while they download
+ART_FETCH_CONNECT_TIMEOUT = 3 #seconds to wait for a connection to the art server
+ART_FETCH_READ_TIMEOUT = 10 #seconds to wait for each read of a download, a stalled server gives up after this
+ART_FETCH_RETRIES = 2 #times a failed download is tried again, with a short backoff
+ART_PREVIEW_SIZE = 320 #pixels of the small art shown while the full size art downloads, for Tidal and Apple art urls
+ART_CROSSFADE_MS = 400 #milliseconds the full size art takes to fade in over the small art
+PREFETCH_NEXT_TRACK = True #find the art and album data of the next track while the current one plays, when the client says what is next
 
-FAST_LOOP_TIME = 0.05 #how fast to run the main loop when there is no new data.
-# Reduces the amount of latency when starting music or skipping songs
-# Increase if you have performance issues
+MAX_PLAYERS = 16 #the most players (npclients) the display keeps track of, the longest idle are forgotten first
+PLAYER_PRIORITY = {} #the player that most recently started playing is shown, unless another playing player has a higher priority
+# e.g. PLAYER_PRIORITY = {"wiim": 1} shows the WiiM over any other player while it is playing
+MAX_QUEUED_CLIENTS = 16 #the most clients that can have payloads waiting for the display loop
+# only the newest state and the newest elapsed time sync of each client wait, older payloads are dropped
+IDLE_LOOP_TIME = 10 #how long the display loop waits for new data while paused, in seconds
+# the display loop wakes up as soon as a payload arrives, so this does not add any latency
 
 # Set main display colors
 BACKGROUND_COLOR = "#000000"
@@ -55,9 +81,14 @@ LOCAL_LONGITUDE = -99.1332
 DEBUG = True
 USE_APPLE_DOWNLOADER = False
 USE_SCREENSAVER = True
+HEADLESS = False #render into memory instead of a window, for benchmarks and machines without a display
+HEADLESS_SIZE = (1920, 1080) #screen size in pixels when headless
+PROFILE_DISPLAY = False #time what the display spends its time on, the results are at /profile (add ?format=folded for flame graphs)
+PROFILE_SPANS = 10000 #the most recent timed operations kept for /profile
 
 # these are the fonts that are used in the UI, they need to be installed on the system
 # and can also be changed to other fonts if desired
 primary_fontname = "Merriweather"
 header_fontname = "Lato"
-mono_fontname = "Noto Mono"
\ No newline at end of file
+mono_fontname = "Noto Mono"
+TEXT_MIN_SIZE_FRACTION = 0.6 #long titles, artists and albums are shrunk down to this fraction of the normal font size to fit
\ No newline at end of file
@@ -1,9 +1,134 @@
 import time
+from dataclasses import dataclass, replace
+from threading import RLock
 from npmusicdata import MusicDataStorage
+from nppayload import format_time, parse_time
+from npqueue import PayloadQueue
+from npprofile import profiler
+
+# update_state() results, UPDATE_NONE is falsy so callers can keep treating the result as a bool
+UPDATE_NONE = 0
+UPDATE_POSITION = 1
+UPDATE_TRACK = 2
+
+
+class PlaybackPosition:
+    """
+    Where playback is in the current track, in whole seconds.
+    While playing, the position moves on from elapsed at the time.monotonic() anchor, so reading
+    it is a couple of integer operations. Positions are never changed, the state replaces them,
+    which lets snapshots share them.
+    """
+    __slots__ = ("duration", "elapsed", "anchor", "playing")
+
+    def __init__(self, duration=0, elapsed=0, anchor=0.0, playing=False):
+        self.duration = duration
+        self.elapsed = elapsed
+        self.anchor = anchor
+        self.playing = playing
+
+    def get_elapsed(self, now=None):
+        '''Seconds played, never more than the duration'''
+        elapsed = self.elapsed
+        if self.playing:
+            elapsed += int((time.monotonic() if now is None else now) - self.anchor)
+        return elapsed if elapsed < self.duration else self.duration
+
+    def get_next_tick(self, now=None):
+        '''Seconds until the elapsed seconds next change, None while they don't change (paused or at the end)'''
+        if not self.playing:
+            return None
+        played = (time.monotonic() if now is None else now) - self.anchor
+        if self.elapsed + int(played) >= self.duration:
+            return None
+        return 1 - played % 1
+
+    def at(self, elapsed):
+        '''The same track at elapsed seconds from now on'''
+        return PlaybackPosition(self.duration, elapsed, time.monotonic(), self.playing)
+
+    def with_duration(self, duration):
+        return PlaybackPosition(duration, self.elapsed, self.anchor, self.playing)
+
+    def paused(self):
+        '''Stop the position where it is now'''
+        return PlaybackPosition(self.duration, self.get_elapsed(), 0.0, False)
+
+    def resumed(self):
+        '''Start moving on again from where the position was stopped'''
+        return PlaybackPosition(self.duration, self.elapsed, time.monotonic(), True)
+
+
+def artist_multi_line(artist):
+    if artist:
+        if len(artist) > 1:
+            if len(artist) < 5:
+                # Ensure each artist name is stripped of leading/trailing spaces
+                return "\n".join(name.strip() for name in artist)
+            else:
+            # Add space after commas and strip whitespace from artist names
+                return ", ".join(name.strip() for name in artist)
+        else:
+            return artist[0].strip()
+    else:
+        return ""
+
+
+def artist_str(artist):
+    if artist:
+        if len(artist) > 1:
+            # Strip leading/trailing spaces and join with ', ' (comma followed by a space)
+            return ", ".join(name.strip() for name in artist)
+        else:
+            return artist[0].strip()
+    else:
+        return ""
+
+
+@dataclass(frozen=True)
+class NowPlayingSnapshot:
+    """
+    Immutable, consistent copy of the NowPlayingState.
+    Taken with NowPlayingState.snapshot() so readers never see a half applied payload.
+    """
+    album: str
+    album_id: str
+    artist: tuple
+    title: str
+    tracks: tuple
+    track: str
+    duration: str
+    elapsed: str
+    npclient: str
+    player_state: str
+    previous_state: str
+    art_url: str
+    quality: str
+    position: PlaybackPosition
+    last_update_time: float
+    next_track: object = None # nppayload.NextTrack the client plays after this one, None if it didn't say
+
+    def get_next(self):
+        '''A snapshot of the next track as if it were playing, for finding its album art and data ahead of time'''
+        next_track = self.next_track
+        return replace(self, title=next_track.title, artist=next_track.artist, album=next_track.album,
+                       art_url=next_track.art_url, album_id="", tracks=(), track="", next_track=None)
+
+    def get_epoc_elapsed(self):
+        return format_time(self.position.get_elapsed())
+
+    def get_artist_multi_line(self):
+        return artist_multi_line(self.artist)
+
+    def get_artist_str(self):
+        return artist_str(self.artist)
+
 
 class NowPlayingState:
     """
     Class to represent and manage the current state of the music player.
+    The display keeps one for each npclient in a PlayerRegistry, which applies the payloads to them.
+    The clients use their own to keep track of what they last sent.
     """
     def __init__(self):
         self.update = False
@@ -18,15 +143,23 @@ class NowPlayingState:
         self.npclient = ""
         self.previous_state = "startup"
         self.player_state = "stopped"
-        self.state_lock = False
+        self.lock = RLock() # held while a payload is applied and while a snapshot is taken
         self.art_url = ""
         self.debug = False
         self.last_update_time = time.time()-60 # clients
         self.last_track_elapsed = 0
-        self.api_payloads = [self.get_empty_payload()]
-        self.last_payload = self.get_empty_payload()
-        self.epoc_start = time.time()  # Track the time the album started
+        self.last_seq = 0 # sequence number of the newest payload applied from the current npclient
+        self.last_payload = None
+        self.position = PlaybackPosition() # elapsed and duration in seconds, moves on by itself while playing
         self.quality = ""
+        self.resolved = None # album art and data found for the current track, see PlayerRegistry
+        self.next_track = None # nppayload.NextTrack the client plays after the current track
+
+    def set_resolved(self, resolved):
+        self.resolved = resolved
+
+    def get_resolved(self):
+        return self.resolved
 
     def set_last_update_time(self):
         self.last_update_time = time.time()
@@ -76,17 +209,29 @@ class NowPlayingState:
     def set_track(self, track):
         self.track = track
 
+    def set_next_track(self, next_track):
+        self.next_track = next_track
+
+    def get_next_track(self):
+        return self.next_track
+
     def set_elapsed(self, elapsed):
-        current_time = int(time.time())
-        # get the time the album started
-        self.epoc_start = current_time - self._time_to_seconds(elapsed)
+        self.set_elapsed_seconds(parse_time(elapsed), elapsed)
+
+    def set_elapsed_seconds(self, seconds, elapsed):
+        # same as set_elapsed(), for callers that have already parsed the time
+        self.position = self.position.at(seconds)
         self.elapsed = elapsed
-        return
 
     def get_elapsed(self):
         return self.elapsed
 
     def set_duration(self, duration):
+        self.set_duration_seconds(parse_time(duration), duration)
+
+    def set_duration_seconds(self, seconds, duration):
+        # same as set_duration(), for callers that have already parsed the time
+        self.position = self.position.with_duration(seconds)
         self.duration = duration
 
     def get_duration(self):
@@ -101,74 +246,17 @@ class NowPlayingState:
     def get_last_payload(self):
         return self.last_payload
 
-    def get_empty_payload(self):
-        return {
-            "album": "",
-            "artist": "",
-            "title": "",
-            "duration": "",
-            "elapsed": "",
-            "state": "",
-            "npclient": ""
-        }
-
     def get_tracks(self):
         return self.tracks
     
     def get_track(self):
         return self.track
 
-    def add_api_payload(self, payload):
-        self.api_payloads.append(payload)
-
-    def get_api_payload(self):
-        # Get the most recent payload, remove it from the list, and return it
-        try:
-            payload = self.api_payloads.pop(0)
-        except:
-            payload = self.get_empty_payload()
-        return payload
-
-    def _time_to_seconds(self, time_str):
-        """
-        Convert a time string in "hh:mm:ss" or "mm:ss" format to seconds.
-        
-        Args:
-            time_str (str): Time in the format "hh:mm:ss" or "mm:ss".
-            
-        Returns:
-            int: The total time in seconds.
-        """
-        try:
-            parts = list(map(int, str(time_str).split(':')))
-            if len(parts) == 3:  # "hh:mm:ss" format
-                hours, minutes, seconds = parts
-            elif len(parts) == 2:  # "mm:ss" format
-                hours, minutes, seconds = 0, *parts
-            else:
-                hours, minutes, seconds = 0, 0, 0
-        except ValueError:
-            hours, minutes, seconds = 0, 0, 0
-
-        return hours * 3600 + minutes * 60 + seconds
-
     def get_epoc_elapsed(self):
-        # Get the elapsed time using epoc
-        try:
-            total_elapsed_seconds = int(time.time() - self.get_epoc_start())
-        except:
-            total_elapsed_seconds = 0
-        elapsed_minutes = total_elapsed_seconds // 60
-        elapsed_seconds = total_elapsed_seconds % 60
-        elapsed = f"{elapsed_minutes}:{elapsed_seconds:02d}"
-        # if elapsed time is greater than the duration, set the elapsed time to the duration
-        if total_elapsed_seconds > self._time_to_seconds(self.get_duration()):
-            elapsed = self.get_duration()
-            # we want to set the display to go inactive here!
-        return elapsed
-
-    def get_epoc_start(self):
-        return self.epoc_start
+        return format_time(self.position.get_elapsed())
+
+    def get_position(self):
+        return self.position
 
     def set_previous_state(self, previous_state):
         self.previous_state = previous_state
@@ -180,49 +268,96 @@ class NowPlayingState:
             return
         self.set_previous_state(self.player_state)
         self.player_state = state.lower()
+        # the position only moves on while playing
+        if self.player_state == "playing" and not self.position.playing:
+            self.position = self.position.resumed()
+        elif self.player_state != "playing" and self.position.playing:
+            self.position = self.position.paused()
 
     def get_player_state(self):
         return self.player_state
 
-    def update_state(self):
-        # use a lock to prevent multiple threads from updating the state at the same time
-        while self.state_lock:
-            time.sleep(0.1)
-        self.state_lock = True
-        result = self._update_state()
-        self.state_lock = False
-        return result
-
-    def _update_state(self):
-        # if the contents of the last api payload are different from the current state,
-        # then update the state from the payload and return True, else return False
-        payload = self.get_api_payload()
-        if payload == self.get_empty_payload():
-            return False
-        elif payload != self.get_last_payload():
-            if payload["state"] == "playing":
-                # only update the durtion/elapsed time if the player is active or playing
-                self.set_duration(payload["duration"])
-                self.set_elapsed(payload["elapsed"])
+    def snapshot(self):
+        '''Return an immutable NowPlayingSnapshot of the current state in one consistent read'''
+        with self.lock:
+            return NowPlayingSnapshot(
+                album=self.album,
+                album_id=self.album_id,
+                artist=tuple(self.artist) if self.artist is not None else None,
+                title=self.title,
+                tracks=tuple(self.tracks),
+                track=self.track,
+                duration=self.duration,
+                elapsed=self.elapsed,
+                npclient=self.npclient,
+                player_state=self.player_state,
+                previous_state=self.previous_state,
+                art_url=self.art_url,
+                quality=self.quality,
+                position=self.position,
+                last_update_time=self.last_update_time,
+                next_track=self.next_track
+            )
+
+    def _update_state(self, payload):
+        # called by PlayerRegistry with the lock held
+        # if the contents of the api payload are different from the current state,
+        # then update the state from the payload and return UPDATE_TRACK or UPDATE_POSITION,
+        # else return UPDATE_NONE
+        if payload is None:
+            return UPDATE_NONE
+        elif payload.is_position():
+            return self._update_position(payload)
+        elif self.last_payload is None or payload.metadata() != self.last_payload.metadata():
+            # position heartbeats never carry the duration, so a track paused before it plays needs it from here
+            self.set_duration_seconds(payload.duration_seconds, payload.duration)
+            if payload.state == "playing":
+                # only move the elapsed time if the player is active or playing
+                self.set_elapsed_seconds(payload.elapsed_seconds, payload.elapsed)
             self.set_last_payload(payload)
-            self.set_title(payload["title"])
-            self.set_artist(payload["artist"])
-            self.set_album(payload["album"])
-            self.set_npclient(payload["npclient"])
-            self.set_player_state(payload["state"])
-            if "art_url" in payload:
-                self.set_art_url(payload["art_url"])
-            else:
-                self.set_art_url("")
-                print("no url received from wiim")
+            self.set_title(payload.title)
+            self.set_artist(list(payload.artist))
+            self.set_album(payload.album)
+            self.set_npclient(payload.npclient)
+            self.set_player_state(payload.state)
+            self.set_art_url(payload.art_url)
             self.set_last_update_time()
-            if "quality" in payload:
-                self.set_quality(payload["quality"])
-            else:
-                self.set_quality("")
-            return True
+            self.set_quality(payload.quality)
+            self.set_next_track(payload.next)
+            # a track payload restarts the sequence, the client may have restarted
+            self.last_seq = payload.seq or 0
+            return UPDATE_TRACK
         else:
-            return False
+            return self._resync_position(payload)
+
+    def _resync_position(self, payload):
+        # a track payload for the current track, clients resend it every few seconds to sync the elapsed time
+        self.last_seq = payload.seq or 0
+        if payload.state == self.player_state and (payload.state != "playing" or payload.elapsed_seconds == self.last_payload.elapsed_seconds):
+            return UPDATE_NONE
+        self.set_last_payload(payload)
+        if payload.state == "playing":
+            self.set_elapsed_seconds(payload.elapsed_seconds, payload.elapsed)
+        self.set_player_state(payload.state)
+        self.set_last_update_time()
+        return UPDATE_POSITION
+
+    def _update_position(self, payload):
+        # apply a position heartbeat without touching the track metadata
+        if payload.npclient != self.npclient:
+            # heartbeat for a track this state doesn't know about
+            return UPDATE_NONE
+        seq = payload.seq
+        if seq is not None:
+            if seq <= self.last_seq:
+                # arrived after a newer payload from the same client
+                return UPDATE_NONE
+            self.last_seq = seq
+        if payload.state == "playing":
+            self.set_elapsed_seconds(payload.elapsed_seconds, payload.elapsed)
+        self.set_player_state(payload.state)
+        self.set_last_update_time()
+        return UPDATE_POSITION
 
     def get_data(self):
         data = {
@@ -239,28 +374,10 @@ class NowPlayingState:
         return data
 
     def get_artist_multi_line(self):
-        if self.artist is not None:
-            if len(self.artist) > 1:
-                if len(self.artist) < 5:
-                    # Ensure each artist name is stripped of leading/trailing spaces
-                    return "\n".join(artist.strip() for artist in self.artist)
-                else:
-                # Add space after commas and strip whitespace from artist names
-                    return ", ".join(artist.strip() for artist in self.artist)
-            else:
-                return self.artist[0].strip()
-        else:
-            return ""
+        return artist_multi_line(self.artist)
 
     def get_artist_str(self):
-        if self.artist is not None:
-            if len(self.artist) > 1:
-                # Strip leading/trailing spaces and join with ', ' (comma followed by a space)
-                return ", ".join(artist.strip() for artist in self.artist)
-            else:
-                return self.artist[0].strip()
-        else:
-            return ""
+        return artist_str(self.artist)
 
     def get_previous_state(self):
         return self.previous_state
@@ -270,4 +387,114 @@ class NowPlayingState:
 
     def get_quality(self):
         return self.quality
-    
\ No newline at end of file
+    
+
+class PlayerRegistry:
+    """
+    Keeps a NowPlayingState for every npclient and decides which one the display shows.
+    The player that most recently started playing wins, a higher PLAYER_PRIORITY lets a
+    player take over from lower priority ones. Each player keeps its own resolved album art
+    and data, so switching back to a player doesn't need to find them again.
+    """
+    def __init__(self, max_players=16, priority=None, max_clients=16):
+        self.lock = RLock()
+        self.players = {} # npclient -> NowPlayingState
+        self.playing_since = {} # npclient -> time the player last started playing
+        self.priority = priority or {} # npclient -> priority, higher wins, default 0
+        self.max_players = max_players
+        self.active = None # npclient shown on the display
+        self.empty = NowPlayingState()
+        self.api_payloads = PayloadQueue(max_clients)
+        self.debug = False
+        self.trace = None # trace of the last payload that changed the shown player
+
+    def set_debug(self, debug):
+        self.debug = debug
+
+    def add_api_payload(self, payload):
+        self.api_payloads.put(payload)
+
+    def get_payload_stats(self):
+        return self.api_payloads.get_stats()
+
+    def get_player(self, npclient):
+        '''Return the NowPlayingState for npclient, or an empty state if the client is unknown'''
+        with self.lock:
+            return self.players.get(npclient, self.empty)
+
+    def get_active(self):
+        return self.get_player(self.active)
+
+    def knows(self, npclient):
+        '''True if a track payload from npclient has been applied'''
+        with self.lock:
+            return npclient in self.players and self.players[npclient].get_npclient() == npclient
+
+    def snapshot(self):
+        '''Snapshot of the player shown on the display'''
+        return self.get_active().snapshot()
+
+    def get_trace(self):
+        '''Trace of the payload behind the last update_state() result, None if it wasn't traced'''
+        return self.trace
+
+    def update_state(self, timeout=0):
+        '''
+        Wait up to timeout seconds for a payload and apply it to its player.
+        Returns UPDATE_TRACK when the display switches to another player, the player's own
+        result for payloads of the shown player, and UPDATE_NONE for the other players.
+        '''
+        self.trace = None
+        payload = self.api_payloads.get(timeout)
+        if payload is None:
+            return UPDATE_NONE
+        return self._apply_payload(payload)
+
+    @profiler.profiled("state_update")
+    def _apply_payload(self, payload):
+        npclient = payload.npclient
+        with self.lock:
+            player = self.players.get(npclient)
+            if player is None:
+                player = self.players[npclient] = NowPlayingState()
+                player.set_debug(self.debug)
+            was_playing = player.get_player_state() == "playing"
+            with player.lock:
+                result = player._update_state(payload)
+            if player.get_player_state() == "playing" and not was_playing:
+                self.playing_since[npclient] = time.monotonic()
+
+            active = self._arbitrate()
+            switched = active != self.active
+            self.active = active
+            # evict once the payload is applied and the display has picked its player,
+            # a new player starts out as the one updated longest ago
+            self._evict(npclient)
+            if switched:
+                self.trace = payload.trace
+                return UPDATE_TRACK
+            if npclient == self.active:
+                if result:
+                    self.trace = payload.trace
+                return result
+            return UPDATE_NONE
+
+    def _arbitrate(self):
+        # highest priority playing player, most recently started first
+        # if nothing is playing, the display stays on the player it shows
+        playing = [npclient for npclient, player in self.players.items()
+                   if player.get_player_state() == "playing" and player.get_npclient() == npclient]
+        if not playing:
+            return self.active if self.active in self.players else next(iter(self.players), None)
+        return max(playing, key=lambda npclient: (self.priority.get(npclient, 0), self.playing_since.get(npclient, 0)))
+
+    def _evict(self, keep):
+        # forget the players that were updated longest ago, never the one on the display or keep,
+        # the player the payload was just applied to
+        while len(self.players) > self.max_players:
+            candidates = [npclient for npclient in self.players if npclient not in (self.active, keep)]
+            if not candidates:
+                return
+            oldest = min(candidates, key=lambda npclient: self.players[npclient].get_last_update_time())
+            del self.players[oldest]
+            self.playing_since.pop(oldest, None)
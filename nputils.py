@@ -6,9 +6,6 @@ from astral import LocationInfo
 from datetime import datetime, timezone
 from tzlocal import get_localzone, get_localzone_name
 import pytz
-import heapq
-import glob
-import os
 import re
 import unicodedata
 import string
@@ -32,19 +29,6 @@ except Exception as e:
     local_timezone = None
     logger.error(e)
 
-def keep_recent_files(folder_path, keep=10000):
-    # Get a list of all PNG files in the folder with their last access time
-    files = [(os.path.getatime(f), f) for f in glob.glob(os.path.join(folder_path, "*.png"))]
-
-    # Sort by access time and keep the most recent files
-    if len(files) > keep:
-        files_to_delete = heapq.nsmallest(len(files) - keep, files)
-    
-        # Delete the files that are not among the most recent "keep" (default 10,000)
-        for _, file_path in files_to_delete:
-            os.remove(file_path)
-            print(f"Deleted {file_path}")
-
 def hex_to_rgb(hex_color):
     """Convert a hex color string (e.g., '#F5F5F5') to an RGB tuple."""
     hex_color = hex_color.lstrip('#')
@@ -17,6 +17,9 @@ except ImportError:
 
 np = NowPlayingState()
 now_playing_lock = False
+last_track = None # the track last posted in full, later posts for it only need a position heartbeat
+sequence = 0 # sequence number of the last payload posted, lets the display drop out of order heartbeats
+retry_until = 0 # time.monotonic() until which the display asked this client not to post (429 Retry-After)
 
 parent_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -39,7 +42,7 @@ def now_playing():
     Gets now playing information by scraping the TIDAL user interface with applescript,
     then sends the information to the now playing display API
     '''
-    global now_playing_lock
+    global now_playing_lock, last_track
     if now_playing_lock:
         return False
     else:
@@ -57,9 +60,18 @@ def now_playing():
 
 
         # post the now playing information to the now playing display API
-        status = post_now_playing(now_playing)
+        # if the track hasn't changed since the last post, only the position is sent
+        track = (now_playing["album"], tuple(now_playing["artist"]), now_playing["title"], now_playing["duration"])
+        status = None
+        if track == last_track:
+            status = post_position(now_playing)
+        if status is None:
+            status = post_now_playing(now_playing)
+            if status:
+                last_track = track
         if not status:
-            time.sleep(10)
+            # wait as long as the display asked, or a while if it is off line
+            time.sleep(retry_delay() or 10)
         now_playing_lock = False
         return True
 
@@ -79,10 +91,37 @@ def increment_time_elapsed(time_elapsed, seconds=1):
     return f"{m + (s + seconds) // 60}:{(s + seconds) % 60:02d}"
 
 
+def next_sequence():
+    global sequence
+    sequence += 1
+    return sequence
+
+
+def retry_delay():
+    '''Seconds left before the display accepts payloads from this client again, 0 if it does now'''
+    return max(0, retry_until - time.monotonic())
+
+
+def rate_limited(response):
+    '''True if the display answered 429, remembers how long it asked this client to wait'''
+    global retry_until
+    if response.status_code != 429:
+        return False
+    try:
+        delay = float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        delay = 1
+    retry_until = time.monotonic() + delay
+    return True
+
+
 def post_now_playing(now_playing):
     url = f'http://{npapi_address}:{npapi_port}/update-now-playing'
     headers = {'Content-Type': 'application/json'}
     data = {
+        "v": 2,
+        "type": "track",
+        "seq": next_sequence(),
         "album": now_playing["album"],
         "artist": now_playing["artist"],
         "title": now_playing["title"],
@@ -92,8 +131,42 @@ def post_now_playing(now_playing):
         "npclient": tidal_client,
     }
     
+    if retry_delay():
+        return False
     try:
         response = requests.post(url, headers=headers, json=data)
+        if rate_limited(response):
+            return False
+        response.raise_for_status()
+        np.set_last_update_time()
+        return True
+    except requests.exceptions.RequestException as e:
+        # display is either off line, or another client is connected
+        return False
+
+
+def post_position(now_playing):
+    '''
+    Post a position heartbeat with only the elapsed time and player state.
+    Returns None if the display asks for the full track payload to be sent again.
+    '''
+    url = f'http://{npapi_address}:{npapi_port}/update-now-playing'
+    data = {
+        "v": 2,
+        "type": "position",
+        "seq": next_sequence(),
+        "elapsed": now_playing["elapsed"],
+        "state": now_playing["state"],
+        "npclient": tidal_client,
+    }
+    if retry_delay():
+        return False
+    try:
+        response = requests.post(url, json=data)
+        if rate_limited(response):
+            return False
+        if response.status_code == 409:
+            return None
         response.raise_for_status()
         np.set_last_update_time()
         return True
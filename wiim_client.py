@@ -12,6 +12,10 @@ except ImportError:
 
 np_client = "wiim"
 np = NowPlayingState()
+unsent_update = False # the last track update didn't reach the display, send it again
+sequence = 0 # sequence number of the last payload posted, lets the display drop out of order heartbeats
+retry_until = 0 # time.monotonic() until which the display asked this client not to post (429 Retry-After)
+next_track = None # the track queued after the current one, sent in the "next" block so the display can get it ready
 wiim = upnpclient.Device(f"http://{wiim_address}:49152/description.xml")
 
 #list of exceptions of artists that should not be split despite containing a comma
@@ -33,6 +37,7 @@ def now_playing():
     Collects now playing information by polling the WiiM player, and then sends it to the NowPlayingDisplay server.
     '''
 
+    global unsent_update, next_track
     info = poll_wiim_info()
 
     send_update = False
@@ -45,16 +50,26 @@ def now_playing():
         np.set_art_url(info["art_url"])
         np.set_elapsed(increment_time(info["elapsed"]))
         np.set_quality(info["quality"])
+        next_track = poll_wiim_next()
+        send_update = True
+    elif unsent_update:
         send_update = True
     else:
         if time.time() - int(np.last_update_time) >= 10:
             np.set_elapsed(increment_time(info["elapsed"]))
             np.set_duration(info["duration"])
-            send_update = True
+            #only the position changed, a small heartbeat is enough to keep the display in sync
+            status = post_position(np.get_elapsed(), np.get_player_state())
+            if status is None:
+                #the display doesn't know the current track (it restarted), send all of it again
+                send_update = True
+            else:
+                return status
 
     #if it is determined that we should send an update to the now_playing server, do so
     if send_update:
         status = post_now_playing(np.get_data())
+        unsent_update = not status
     else:
         status = True
 
@@ -157,14 +172,7 @@ def poll_wiim_info():
             depth = 0
 
         #try to get album art url
-        try:
-            arttmp = TrackMetaData["upnp:albumArtURI"]
-            if isinstance(arttmp, dict):
-                arturl = arttmp["#text"]
-            else:
-                arturl = arttmp
-        except:
-            arturl = ""
+        arturl = album_art_url(TrackMetaData)
 
         old_title = title
 
@@ -179,6 +187,36 @@ def poll_wiim_info():
         "quality": f"{depth} bits / {SampleRate} kHz {bitrate}"
     }
 
+def album_art_url(metadata):
+    # the album art url of a DIDL-Lite item, "" if it has none
+    try:
+        arttmp = metadata["upnp:albumArtURI"]
+        if isinstance(arttmp, dict):
+            return arttmp["#text"]
+        return arttmp or ""
+    except:
+        return ""
+
+def poll_wiim_next():
+    # Get the track queued after the current one from the NextURIMetaData of the WiiM
+    # returns None if the WiiM doesn't say (radio, the end of the queue, or no next track metadata)
+    try:
+        MediaInfo = wiim.AVTransport.GetMediaInfo(InstanceID="0")
+        NextMetaData = xmltodict.parse(MediaInfo["NextURIMetaData"])["DIDL-Lite"]["item"]
+    except Exception:
+        return None
+
+    title = NextMetaData.get("dc:title", "")
+    if not title:
+        return None
+    artist = NextMetaData.get("upnp:artist", "")
+    return {
+        "title": title,
+        "artist": split_artists(artist, exceptions) if artist else [],
+        "album": NextMetaData.get("upnp:album", "") or "",
+        "art_url": album_art_url(NextMetaData)
+    }
+
 def split_artists(artist_string, exceptions):
     # Dictionary to store placeholders and corresponding exception artist names
     placeholders = {}
@@ -199,10 +237,37 @@ def split_artists(artist_string, exceptions):
     return artist_list
 
 
+def next_sequence():
+    global sequence
+    sequence += 1
+    return sequence
+
+
+def retry_delay():
+    '''Seconds left before the display accepts payloads from this client again, 0 if it does now'''
+    return max(0, retry_until - time.monotonic())
+
+
+def rate_limited(response):
+    '''True if the display answered 429, remembers how long it asked this client to wait'''
+    global retry_until
+    if response.status_code != 429:
+        return False
+    try:
+        delay = float(response.headers.get("Retry-After", 1))
+    except ValueError:
+        delay = 1
+    retry_until = time.monotonic() + delay
+    return True
+
+
 def post_now_playing(now_playing):
     url = f'http://{npapi_address}:{npapi_port}/update-now-playing'
     headers = {'Content-Type': 'application/json'}
     data = {
+        "v": 2,
+        "type": "track",
+        "seq": next_sequence(),
         "album": now_playing.get("album", ""),
         "artist": now_playing.get("artist", ""),
         "title": now_playing.get("title", ""),
@@ -213,15 +278,51 @@ def post_now_playing(now_playing):
         "art_url": now_playing.get("art_url", ""),
         "npclient": np_client,
     }
+    if next_track is not None:
+        data["next"] = next_track
+    if retry_delay():
+        return False
     try:
         response = requests.post(url, headers=headers, json=data)
+        if rate_limited(response):
+            return False
         response.raise_for_status()
         np.set_last_update_time()
         return True
     except requests.exceptions.RequestException as e:
         print("Failed to send now playing update", e)
         return False
-    
+
+
+def post_position(elapsed, state):
+    '''
+    Post a position heartbeat with only the elapsed time and player state.
+    Returns None if the display asks for the full track payload to be sent again.
+    '''
+    url = f'http://{npapi_address}:{npapi_port}/update-now-playing'
+    data = {
+        "v": 2,
+        "type": "position",
+        "seq": next_sequence(),
+        "elapsed": elapsed,
+        "state": state,
+        "npclient": np_client,
+    }
+    if retry_delay():
+        return False
+    try:
+        response = requests.post(url, json=data)
+        if rate_limited(response):
+            return False
+        if response.status_code == 409:
+            return None
+        response.raise_for_status()
+        np.set_last_update_time()
+        return True
+    except requests.exceptions.RequestException as e:
+        print("Failed to send now playing position", e)
+        return False
+
 
 def main():
     while True: